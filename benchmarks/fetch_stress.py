@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+Stress test for concurrent fetching: serves many synthetic AUR-snapshots from
+a local HTTP-server and fetches them all at once through blinky's fetch
+scheduler, while another thread keeps changing the working directory of the
+process. Checks that every package ends up complete in its own directory of
+the build directory and nothing is written relative to the working directory.
+
+Exits non-zero if any package is missing, incomplete or misplaced.
+"""
+
+import sys, os, io, time, types, random, tarfile, argparse, tempfile, threading, concurrent.futures
+import http.server
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, basedir)
+
+from blinky import utils
+
+
+def make_snapshot(name, nfiles):
+	"""returns a gzipped tarball looking like an AUR-snapshot of package name"""
+	files = {'PKGBUILD': "pkgname={}\npkgver=1.0\npkgrel=1\n".format(name).encode()}
+	for i in range(nfiles):
+		files['file{}.patch'.format(i)] = "{} {}\n".format(name, i).encode() * 64
+
+	buf = io.BytesIO()
+	with tarfile.open(fileobj=buf, mode='w:gz') as tarball:
+		for fname, content in files.items():
+			info = tarfile.TarInfo('{}/{}'.format(name, fname))
+			info.size = len(content)
+			tarball.addfile(info, io.BytesIO(content))
+
+	return buf.getvalue(), files
+
+
+class SnapshotHandler(http.server.BaseHTTPRequestHandler):
+	snapshots = {}
+
+	def do_GET(self):
+		data = self.snapshots.get(self.path)
+		if data is None:
+			self.send_error(404)
+			return
+
+		self.send_response(200)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, *args):
+		pass
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--packages", type=int, default=200, help="number of packages fetched (default: 200)")
+	parser.add_argument("--files", type=int, default=20, help="files per package (default: 20)")
+	parser.add_argument("--jobs", type=int, default=32, help="concurrent fetches (default: 32)")
+	args = parser.parse_args()
+
+	tmpdir = tempfile.mkdtemp(prefix='blinky-stress-')
+	builddir, logdir = os.path.join(tmpdir, 'build'), os.path.join(tmpdir, 'logs')
+	cwddirs = [os.path.join(tmpdir, 'cwd{}'.format(i)) for i in range(4)]
+	for d in [builddir, logdir] + cwddirs:
+		os.makedirs(d)
+
+	expected = {}
+	for i in range(args.packages):
+		name = 'stress-pkg-{}'.format(i)
+		SnapshotHandler.snapshots['/cgit/aur.git/snapshot/{}.tar.gz'.format(name)], expected[name] = make_snapshot(name, args.files)
+
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SnapshotHandler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	utils.AUR_URL = 'http://127.0.0.1:{}'.format(server.server_address[1])
+	utils.configure_session(pool_size=args.jobs)
+
+	from blinky.package_tree import SourcePkg
+	from blinky.scheduler import FetchScheduler
+
+	ctx = types.SimpleNamespace(v=0, builddir=builddir, logdir=logdir, source_backend='tarball')
+	srcpkgs = [SourcePkg(name, '1.0-1', '/cgit/aur.git/snapshot/{}.tar.gz'.format(name), ctx=ctx) for name in expected]
+
+	# keep moving the working directory around while fetching
+	stop = threading.Event()
+	def wander():
+		while not stop.is_set():
+			os.chdir(random.choice(cwddirs))
+			time.sleep(0.0005)
+
+	wanderer = threading.Thread(target=wander)
+	wanderer.start()
+
+	fetcher = FetchScheduler(ctx, jobs=args.jobs)
+	start = time.monotonic()
+	futures = [fetcher.fetch(srcpkg) for srcpkg in srcpkgs]
+	concurrent.futures.wait(futures)
+	duration = time.monotonic() - start
+
+	stop.set()
+	wanderer.join()
+	server.shutdown()
+
+	errors = []
+	for name, files in expected.items():
+		for fname, content in files.items():
+			path = os.path.join(builddir, name, fname)
+			if not os.path.isfile(path):
+				errors.append("{}: missing".format(path))
+				continue
+			with open(path, 'rb') as f:
+				if f.read() != content:
+					errors.append("{}: wrong content".format(path))
+
+	for d in cwddirs:
+		for fname in os.listdir(d):
+			errors.append("{}: written relative to the working directory".format(os.path.join(d, fname)))
+
+	for e in errors[:20]:
+		print(e)
+
+	print("{} packages with {} files each in {:.2f}s using {} jobs: {}".format(args.packages, args.files + 1, duration, args.jobs, "FAIL ({} errors)".format(len(errors)) if errors else "ok"))
+	sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+	main()
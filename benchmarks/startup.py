@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Startup benchmark: measures for every subcommand how long blinky takes from
+being started until it begins with the actual work of that subcommand, and
+checks that no heavy modules (libalpm, requests, ...) are loaded up to then.
+
+Fails if a subcommand got slower than its stored baseline (plus tolerance) or
+loads a heavy module. Run with --update-baseline to store new baselines.
+"""
+
+import sys, os, json, argparse, subprocess, statistics, tempfile
+
+basedir  = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script   = os.path.join(basedir, 'scripts', 'blinky')
+baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_baseline.json')
+
+heavy_modules = ['pyalpm', 'pycman', 'requests', 'urllib3', 'termcolor', 'packaging', 'xdg']
+
+subcommands = {
+	'version':  ['--version'],
+	'complete': ['-complete', 'foo'],
+	'search':   ['-Ss', 'foo'],
+	'info':     ['-Si', 'foo'],
+	'checkupdates': ['-Qu'],
+	'install':  ['-S', 'foo'],
+	'upgrade':  ['-Syu'],
+	'clean':    ['-Sc'],
+}
+
+# runs blinky without entering the __main__-block, i.e. only its startup
+driver = '''
+import sys, time, json, runpy
+start = time.perf_counter()
+sys.argv = ['blinky'] + sys.argv[2:]
+runpy.run_path(SCRIPT, run_name='blinky_startup')
+duration = time.perf_counter() - start
+print(json.dumps({"time": duration, "modules": [m for m in HEAVY if m in sys.modules]}))
+'''
+
+
+def measure(args, runs, env, makepkgconf):
+	code = driver.replace('SCRIPT', repr(script)).replace('HEAVY', repr(heavy_modules))
+	times, modules = [], set()
+	for _ in range(runs):
+		r = subprocess.run([sys.executable, '-c', code, '--', '--makepkg.conf', makepkgconf] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=basedir)
+		if r.returncode != 0:
+			raise RuntimeError("blinky {} failed: {}".format(" ".join(args), r.stderr.decode()))
+		result = json.loads(r.stdout.decode().strip().split('\n')[-1])
+		times.append(result["time"])
+		modules.update(result["modules"])
+
+	return statistics.median(times), sorted(modules)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--runs", type=int, default=10, help="runs per subcommand, the median is taken")
+	parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown relative to the baseline (default: 0.5)")
+	parser.add_argument("--update-baseline", action='store_true', default=False, help="store the measured times as new baseline")
+	args = parser.parse_args()
+
+	env = dict(os.environ)
+	env["PYTHONPATH"] = basedir + os.pathsep + env.get("PYTHONPATH", "")
+	tmpdir = tempfile.mkdtemp(prefix='blinky-bench-')
+	env["XDG_CACHE_HOME"] = os.path.join(tmpdir, 'cache')
+	env["XDG_DATA_HOME"] = os.path.join(tmpdir, 'data')
+
+	# independent of whether the host has a makepkg.conf
+	makepkgconf = os.path.join(tmpdir, 'makepkg.conf')
+	with open(makepkgconf, 'w') as f:
+		f.write("PKGEXT='.pkg.tar.zst'\n")
+
+	baselines = {}
+	if os.path.exists(baseline):
+		with open(baseline) as f:
+			baselines = json.load(f)
+
+	failed = False
+	results = {}
+	for name, subcmd_args in subcommands.items():
+		duration, modules = measure(subcmd_args, args.runs, env, makepkgconf)
+		results[name] = duration
+
+		state = "ok"
+		if modules:
+			state = "FAIL (loads {})".format(", ".join(modules))
+			failed = True
+		elif name in baselines and duration > baselines[name] * (1 + args.tolerance) + 0.005:
+			state = "FAIL (baseline {:.1f} ms)".format(baselines[name] * 1000)
+			failed = True
+
+		print("{:<14} {:>8.1f} ms  {}".format(name, duration * 1000, state))
+
+	if args.update_baseline:
+		with open(baseline, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+			f.write('\n')
+
+	sys.exit(1 if failed and not args.update_baseline else 0)
+
+
+if __name__ == "__main__":
+	main()
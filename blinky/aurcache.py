@@ -0,0 +1,47 @@
+import os, json, time, tempfile
+
+class AURInfoCache:
+	"""
+	On-disk cache for the per-package records returned by info-queries to the
+	AUR-RPC. Every package gets its own file, which is replaced atomically, so
+	that several blinky-processes can share the cache without locking.
+
+	Packages not found in the AUR are cached as well (as negative record), as
+	most dependencies are looked up in the AUR regardless of living in the repos.
+	"""
+
+	def __init__(self, cachedir, ttl):
+		self.cachedir = cachedir
+		self.ttl      = ttl
+		os.makedirs(self.cachedir, exist_ok=True)
+
+	def path(self, name):
+		# package names cannot contain slashes, but better be safe than sorry
+		return os.path.join(self.cachedir, name.replace('/', '_') + '.json')
+
+	def get(self, name):
+		"""
+		Returns (hit, record), where record is None for packages known to not
+		exist in the AUR. Expired or unreadable entries count as miss.
+		"""
+		try:
+			with open(self.path(name), 'r') as f:
+				entry = json.load(f)
+		except (OSError, ValueError):
+			return False, None
+
+		if time.time() - entry.get("fetched", 0) > self.ttl:
+			return False, None
+
+		return True, entry.get("record")
+
+	def put(self, name, record):
+		entry = {"fetched": time.time(), "record": record}
+		fd, tmppath = tempfile.mkstemp(dir=self.cachedir, prefix='.tmp-')
+		try:
+			with os.fdopen(fd, 'w') as f:
+				json.dump(entry, f)
+			os.replace(tmppath, self.path(name))
+		except OSError:
+			if os.path.exists(tmppath):
+				os.remove(tmppath)
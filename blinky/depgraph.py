@@ -0,0 +1,90 @@
+class DependencyGraph:
+	"""
+	Index over a resolved dependency graph, built once after resolution. The
+	packages that are part of dependency cycles are computed upfront, build_set()
+	and layers() tell what to build and in which batches.
+	"""
+
+	def __init__(self, packages):
+		self.roots = list(packages)
+
+		self.nodes, stack = [], list(packages)
+		seen = set()
+		while stack:
+			p = stack.pop()
+			if p not in seen:
+				seen.add(p)
+				self.nodes.append(p)
+				stack += p.deps + p.makedeps
+
+		self.cyclic = self.find_cyclic()
+
+	def find_cyclic(self):
+		"""returns the packages on dependency cycles (not those merely depending on one)"""
+		edges = {p: set(d for d in p.deps + p.makedeps if d is not p) for p in self.nodes}
+		dependents = {p: set() for p in self.nodes}
+		for p, deps in edges.items():
+			for d in deps:
+				dependents[d].add(p)
+
+		# peel off everything that does not depend on a cycle...
+		pending = {p: len(deps) for p, deps in edges.items()}
+		ready = [p for p in self.nodes if pending[p] == 0]
+		while ready:
+			p = ready.pop()
+			for d in dependents[p]:
+				pending[d] -= 1
+				if pending[d] == 0:
+					ready.append(d)
+
+		# ...and of what is left, everything no cycle depends on
+		blocked = set(p for p in self.nodes if pending[p] > 0)
+		remaining = {p: len(dependents[p] & blocked) for p in blocked}
+		tails = [p for p in blocked if remaining[p] == 0]
+		while tails:
+			p = tails.pop()
+			blocked.discard(p)
+			for d in edges[p] & blocked:
+				remaining[d] -= 1
+				if remaining[d] == 0:
+					tails.append(d)
+
+		return blocked
+
+	def build_set(self, roots):
+		"""
+		Returns everything from the AUR that has to be built for the given packages:
+		the packages themselves and all their deps and makedeps from the AUR that are
+		not installed yet, including their deps and makedeps in turn.
+		"""
+		build, stack = set(), list(roots)
+		while stack:
+			p = stack.pop()
+			if p not in build and p.in_aur and (p in roots or not p.installed):
+				build.add(p)
+				stack += p.deps + p.makedeps
+
+		return build
+
+	def layers(self, pkgs):
+		"""
+		Splits pkgs into batches to be built and installed one after the other, so
+		that every package only depends on packages of earlier batches. Packages on
+		or behind a dependency cycle within pkgs are left out.
+		"""
+		pkgs = set(pkgs)
+		pending = {p: set(d for d in p.deps + p.makedeps if d in pkgs and d is not p) for p in pkgs}
+
+		layers = []
+		while True:
+			layer = sorted([p for p, deps in pending.items() if not deps], key=lambda p: p.name)
+			if not layer:
+				break
+
+			for p in layer:
+				del pending[p]
+			for deps in pending.values():
+				deps.difference_update(layer)
+			layers.append(layer)
+
+		return layers
@@ -0,0 +1,69 @@
+import os, subprocess
+from blinky import utils
+
+# the ref in which the last positively reviewed commit of a package base is recorded
+REVIEWED_REF = "refs/blinky/reviewed"
+
+
+class GitSourceError(Exception):
+	pass
+
+
+class GitSource:
+	"""
+	Keeps a persistent bare clone of the AUR-repository of a package base, so that
+	subsequent runs only have to fetch the commits added since the last run
+	instead of a full snapshot. Also remembers the last reviewed commit, which
+	serves as baseline for the next review.
+	"""
+
+	def __init__(self, pkgbase, gitdir, url):
+		self.pkgbase = pkgbase
+		self.gitdir  = gitdir
+		self.url     = url
+
+	def git(self, *args, **kwargs):
+		return subprocess.run(['git', '--git-dir', self.gitdir] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+
+	def sync(self):
+		"""clones the repository or fetches new commits, returns the commit to build"""
+		if os.path.isdir(self.gitdir):
+			r = self.git('fetch', '--quiet', '--prune', self.url, '+refs/heads/*:refs/heads/*')
+		else:
+			r = subprocess.run(['git', 'clone', '--quiet', '--bare', self.url, self.gitdir], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+		if r.returncode != 0:
+			raise GitSourceError(r.stderr.decode(errors='replace').strip())
+
+		return self.rev_parse('HEAD')
+
+	def rev_parse(self, rev):
+		r = self.git('rev-parse', '--verify', '--quiet', rev + '^{commit}')
+		return r.stdout.decode().strip() if r.returncode == 0 else None
+
+	def checkout(self, commit, destdir):
+		"""
+		Writes the files of the given commit to destdir/<pkgbase>, just as
+		the extracted snapshot-tarball would look like.
+		"""
+		prefix = '{}/'.format(self.pkgbase)
+		p = subprocess.Popen(['git', '--git-dir', self.gitdir, 'archive', '--format=tar', '--prefix', prefix, commit], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		try:
+			utils.extract_tarball(p.stdout, destdir, self.pkgbase, compression='')
+		finally:
+			p.stdout.close()
+			retval = p.wait()
+
+		if retval != 0:
+			raise GitSourceError("git archive of {} failed with exit code {}".format(commit, retval))
+
+	def reviewed_commit(self):
+		return self.rev_parse(REVIEWED_REF)
+
+	def mark_reviewed(self, commit):
+		self.git('update-ref', REVIEWED_REF, commit)
+
+	def show_file(self, commit, fname):
+		"""returns the content of fname as of the given commit, None if it did not exist"""
+		r = self.git('show', '{}:{}'.format(commit, fname))
+		return r.stdout if r.returncode == 0 else None
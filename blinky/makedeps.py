@@ -0,0 +1,69 @@
+import os, json, time, tempfile
+
+class KeepWarmState:
+	"""
+	Remembers across runs how often and how recently makedeps were needed and
+	which of them blinky keeps installed instead of removing them after the
+	build. Frequently used makedeps are kept as long as they fit into the disk
+	budget; the least recently used ones are evicted first and removed again.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		try:
+			with open(path, 'r') as f:
+				self.entries = json.load(f)
+		except (OSError, ValueError):
+			self.entries = {}  # name -> {"uses": int, "last_used": float, "kept": bool}
+
+	def record_usage(self, names, now=None):
+		now = now or time.time()
+		for name in names:
+			entry = self.entries.setdefault(name, {"uses": 0, "last_used": 0, "kept": False})
+			entry["uses"] += 1
+			entry["last_used"] = now
+
+	def kept(self):
+		return set(name for name, entry in self.entries.items() if entry["kept"])
+
+	def plan(self, candidates, sizes, budget, min_uses):
+		"""
+		Decides which of the candidates (makedeps installed by blinky, i.e. this
+		run's plus the ones kept so far) stay installed, given their installed
+		sizes. Returns the set of those to remove.
+		"""
+		eligible = [name for name in candidates if self.entries.get(name, {}).get("uses", 0) >= min_uses]
+		eligible.sort(key=lambda name: self.entries[name]["last_used"], reverse=True)
+
+		keep, used = set(), 0
+		for name in eligible:
+			if used + sizes.get(name, 0) <= budget:
+				keep.add(name)
+				used += sizes.get(name, 0)
+
+		for name in candidates:
+			if name in self.entries:
+				self.entries[name]["kept"] = name in keep
+
+		return set(candidates) - keep
+
+	def reconcile(self, is_installed):
+		"""
+		Stops keeping makedeps that are not installed anymore, e.g. because they
+		were removed as orphans, and returns them.
+		"""
+		gone = set(name for name in self.kept() if not is_installed(name))
+		for name in gone:
+			self.forget(name)
+		return gone
+
+	def forget(self, name):
+		"""stops tracking a makedep, e.g. because the user installed it explicitly"""
+		if name in self.entries:
+			self.entries[name]["kept"] = False
+
+	def save(self):
+		fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.makedeps-')
+		with os.fdopen(fd, 'w') as f:
+			json.dump(self.entries, f, indent=1, sort_keys=True)
+		os.replace(tmppath, self.path)
@@ -0,0 +1,62 @@
+import os, subprocess, threading
+from collections import namedtuple
+
+DEFAULT_MAKEPKGCONF = '/etc/makepkg.conf'
+
+MakepkgEnv = namedtuple('MakepkgEnv', ['pkgext', 'carch', 'pkgdest', 'srcdest'])
+
+# sources makepkg's configuration the same way makepkg does
+# and prints the variables we are interested in
+_config_script = r'''
+[[ -r $1 ]] || exit 1
+source "$1"
+if [[ -d "$1.d" ]]; then
+	for conf in "$1.d"/*.conf; do
+		[[ -r $conf ]] && source "$conf"
+	done
+fi
+if [[ $1 = /etc/makepkg.conf ]]; then
+	if [[ -r ${XDG_CONFIG_HOME:-$HOME/.config}/pacman/makepkg.conf ]]; then
+		source "${XDG_CONFIG_HOME:-$HOME/.config}/pacman/makepkg.conf"
+	elif [[ -r ~/.makepkg.conf ]]; then
+		source ~/.makepkg.conf
+	fi
+fi
+printf '%s\0' "$PKGEXT" "$CARCH" "$PKGDEST" "$SRCDEST"
+'''
+
+_envs      = {}
+_envs_lock = threading.Lock()
+
+def get_env(makepkgconf=DEFAULT_MAKEPKGCONF):
+	"""
+	Evaluates the given makepkg.conf once per run. Variables set in the
+	environment take precedence, just as they do for makepkg.
+	"""
+	with _envs_lock:
+		if makepkgconf not in _envs:
+			r = subprocess.run(['bash', '-c', _config_script, 'makepkg.conf', makepkgconf], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+			values = r.stdout.decode(errors='replace').split('\0')[:4] if r.returncode == 0 else []
+			values += [''] * (4 - len(values))
+			pkgext, carch, pkgdest, srcdest = values
+
+			_envs[makepkgconf] = MakepkgEnv(
+					pkgext=os.environ.get('PKGEXT') or pkgext or '.pkg.tar.xz',
+					carch=os.environ.get('CARCH') or carch or os.uname().machine,
+					pkgdest=os.environ.get('PKGDEST') or pkgdest or None,
+					srcdest=os.environ.get('SRCDEST') or srcdest or None
+					)
+
+		return _envs[makepkgconf]
+
+
+def package_list(srcdir, makepkgconf=DEFAULT_MAKEPKGCONF):
+	"""
+	Returns the full paths of all package files makepkg builds from the PKGBUILD
+	in srcdir, None if makepkg cannot tell.
+	"""
+	r = subprocess.run(['makepkg', '--config', makepkgconf, '--packagelist'], cwd=srcdir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+	if r.returncode != 0:
+		return None
+
+	return [line for line in r.stdout.decode(errors='replace').split('\n') if line]
@@ -1,63 +1,203 @@
-import requests, subprocess, os, shutil, sys, stat, asyncio, hashlib, concurrent
+import subprocess, os, re, shutil, sys, stat, asyncio, tempfile, threading, tarfile, time, concurrent.futures
 from termcolor import colored
-from blinky import pacman, utils
+from blinky import gitsource, makepkg, pacman, pkgcache, profiling, reviewstore, session, utils
 
 # pkg_store holds all packages so that we have all package-objects
 # to build the fully interconnected package graph
 pkg_store            = {}
 srcpkg_store         = {}
 
-# the instantiated-list hold all instantiated packages to fix race
-# conditions upon instantiating afterwards by dedup
-instantiated_pkgs    = []
-
-def dedup_pkgs(ctx):
-	if len(pkg_store) != len(instantiated_pkgs):
-		dup_number = len(instantiated_pkgs) - len(pkg_store)
-		utils.logmsg(ctx.v, 3, "Deduplicating {} packages".format(dup_number))
-		name2obj = {}
-		for name, obj in instantiated_pkgs:
-			if name in name2obj:
-				# we have at least two, let's merge the tree here
-				utils.logmsg(ctx.v, 3, "Deduplicating package: {}".format(name))
-				name2obj[name].parents += obj.parents
-				for p in obj.parents:
-					if obj in p.deps:
-						p.deps.remove(obj)
-						p.deps.append(name2obj[name])
-					elif obj in p.makedeps:
-						p.makedeps.remove(obj)
-						p.makedeps.append(name2obj[name])
-			else:
-				name2obj[name] = obj
-
+# every requested name is instantiated exactly once per run: concurrent requests
+# for the same name wait for the same future, and names provided by the same
+# package (e.g. 'sh' and 'bash') end up with the same Package-object
+pkg_futures          = {}  # requested name -> future of its Package
+pkg_by_name          = {}  # actual package name -> Package
+first_request        = {}  # actual package name -> name it was first requested by
+unsatisfiable        = {}  # requested name -> reason
+intern_lock          = threading.Lock()
+intern_stats         = {"requests": 0, "inflight_hits": 0, "aliases": 0}
 
-def parse_dep_pkg(pkgname, ctx, parentpkg=None, aurdata=None):
-	packagename = pkgname.split('>=')[0].split('=')[0]
+# downloads upstream sources of reviewed packages while the user reviews the next ones
+prefetch_executor    = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
-	if packagename not in pkg_store:
-		pkg = Package(packagename, ctx=ctx, firstparent=parentpkg, aurdata=aurdata)
-		pkg_store[packagename] = pkg
-		instantiated_pkgs.append((pkgname, pkg))
-	elif parentpkg:
-		pkg_store[packagename].parents.append(parentpkg)
 
-	return pkg_store[packagename]
+def strip_version(depname):
+	"""turns a dependency like 'foo>=1.2' into the plain package name 'foo'"""
+	return re.split('[<>=]', depname)[0]
 
 
 def parse_src_pkg(src_id, version, tarballpath, ctx):
 	if src_id not in srcpkg_store:
 		srcpkg_store[src_id] = SourcePkg(src_id, version, tarballpath, ctx=ctx)
 
+	return srcpkg_store[src_id]
+
+
+def instantiate_package(packagename, ctx, parent):
+	with profiling.span("resolve " + packagename, "resolve"):
+		pkg = Package(packagename, ctx, parent)
+	with intern_lock:
+		if pkg.name in pkg_by_name:
+			intern_stats["aliases"] += 1
+			return pkg_by_name[pkg.name]
+
+		pkg_by_name[pkg.name] = pkg
+		first_request[pkg.name] = packagename
+		return pkg
+
+
+def intern_package(packagename, ctx, parent, executor):
+	"""
+	Returns the future of the Package for packagename, which is only instantiated
+	if nobody did so before or is currently at it.
+	"""
+	with intern_lock:
+		intern_stats["requests"] += 1
+		if packagename in pkg_futures:
+			intern_stats["inflight_hits"] += 1
+		else:
+			pkg_futures[packagename] = executor.submit(instantiate_package, packagename, ctx, parent)
+
+		return pkg_futures[packagename]
+
+
+def query_aur_batch(pkgnames):
+	"""
+	Looks up all given packages in the AUR at once,
+	returns a dict mapping the names found to their AUR-data.
+	"""
+	with profiling.span("AUR info batch", "resolve", packages=len(pkgnames)):
+		r = utils.query_aur("info", pkgnames)
+	return {pkgdata["Name"]: pkgdata for pkgdata in r["results"]}
+
+
+def resolve_packages(pkgnames, ctx):
+	"""
+	Resolves the dependency graph of the given packages breadth-first: the names of
+	all yet unknown packages of one level of the graph are collected and looked up
+	in the AUR together, so the number of queries scales with the depth of the graph
+	instead of the number of its nodes. All packages end up in pkg_store.
+
+	Returns the requested packages whose dependency graph could be fully resolved,
+	all others are reported and dropped.
+	"""
+	edges = []    # (parent, package name, 'dep' or 'makedep')
+	aliases = {}  # requested name -> Package first requested by another name
+
+	level = [(name, None, None) for name in pkgnames]
+	toplevel = True
+	with concurrent.futures.ThreadPoolExecutor(max_workers=10) as e:
+		while level:
+			instantiating = {}
+			for depname, parent, kind in level:
+				packagename = strip_version(depname)
+				if parent:
+					edges.append((parent, packagename, kind))
+
+				if packagename not in pkg_store and packagename not in unsatisfiable and packagename not in instantiating:
+					instantiating[packagename] = intern_package(packagename, ctx, parent, e)
+
+			new_pkgs = {}
+			for packagename, instantiation in instantiating.items():
+				try:
+					pkg = instantiation.result()
+				except utils.UnsatisfiableDependencyError as err:
+					unsatisfiable[packagename] = str(err)
+					continue
+
+				if first_request[pkg.name] == packagename:
+					new_pkgs[packagename] = pkg
+				else:
+					aliases[packagename] = pkg
+
+			lookup = [p.name for p in new_pkgs.values() if not p.in_repos]
+			utils.logmsg(ctx.v, 3, "Resolving {} packages, {} of them via AUR".format(len(new_pkgs), len(lookup)))
+			try:
+				aurdata = query_aur_batch(lookup)
+			except utils.APIError as err:
+				msg = "Dependency unsatisfiable via AUR, repos or installed packages: {}"
+				if err.type == 'ratelimit':
+					msg = "Dependency unsatisfiable due to rate limit on AUR-API, try again tomorrow: {}"
+				elif err.type == 'unavailable':
+					msg = "Dependency unsatisfiable due to unavailability of AUR-API, try again later: {}"
+
+				for packagename, pkg in new_pkgs.items():
+					if not pkg.in_repos:
+						unsatisfiable[packagename] = msg.format(pkg.name)
+				aurdata = {}
+
+			level = []
+			for packagename, pkg in new_pkgs.items():
+				if packagename in unsatisfiable:
+					continue
+
+				pkgdata = aurdata.get(pkg.name)
+				if toplevel and ctx.ignore_ood and pkgdata and pkgdata["OutOfDate"] is not None:
+					pkgdata = None  # only explicitly requested packages are subject to --ignore-ood
+
+				try:
+					pkg.set_aurdata(pkgdata)
+				except utils.UnsatisfiableDependencyError as err:
+					unsatisfiable[packagename] = str(err)
+					continue
+
+				pkg_store[packagename] = pkg
+				level += [(depname, pkg, 'dep') for depname in pkg.depnames]
+				level += [(depname, pkg, 'makedep') for depname in pkg.makedepnames]
+
+			toplevel = False
+
+	for packagename, pkg in aliases.items():
+		first = first_request[pkg.name]
+		if first in pkg_store:
+			pkg_store[packagename] = pkg_store[first]
+		else:
+			unsatisfiable[packagename] = unsatisfiable.get(first, "Dependency unsatisfiable: {}".format(pkg.name))
+
+	msg = "Resolved {} packages: {} requests, {} served by an in-flight or finished lookup, {} aliases of other packages"
+	utils.logmsg(ctx.v, 1, msg.format(len(pkg_by_name), intern_stats["requests"], intern_stats["inflight_hits"], intern_stats["aliases"]))
+
+	# interconnect the graph
+	for parent, packagename, kind in edges:
+		if packagename not in pkg_store:
+			continue
+
+		pkg = pkg_store[packagename]
+		deplist = parent.deps if kind == 'dep' else parent.makedeps
+		if pkg not in deplist:
+			deplist.append(pkg)
+		if parent not in pkg.parents:
+			pkg.parents.append(parent)
+
+	# a package can only be built if its entire dependency graph could be resolved
+	reasons = {}
+	def unsatisfiable_reason(packagename):
+		if packagename in unsatisfiable:
+			return unsatisfiable[packagename]
+		if packagename not in reasons:
+			reasons[packagename] = None  # guards against dependency cycles
+			pkg = pkg_store[packagename]
+			for depname in pkg.depnames + pkg.makedepnames:
+				reason = unsatisfiable_reason(depname)
+				if reason:
+					reasons[packagename] = reason + " for {}".format(pkg.name)
+					break
+
+		return reasons[packagename]
+
+	packages = []
+	for name in pkgnames:
+		reason = unsatisfiable_reason(strip_version(name))
+		if reason:
+			utils.logerr(None, "Cannot build {}: {}".format(name, reason))
+		else:
+			packages.append(pkg_store[strip_version(name)])
+
+	return packages
+
 
 def pkg_in_cache(pkg):
-	pkgs = []
-	pkgprefix = '{}-{}-'.format(pkg.name, pkg.version_latest)
-	for pkg in os.listdir(pkg.ctx.cachedir):
-		if pkgprefix in pkg:
-			# was already built at some point
-			pkgs.append(pkg)
-	return pkgs
+	return pkgcache.get_index(pkg.ctx.cachedir).lookup(pkg.name, pkg.version_latest)
 
 
 class SourcePkg:
@@ -66,63 +206,221 @@ class SourcePkg:
 		self.ctx           = ctx
 		self.name          = name
 		self.version       = version
-		self.tarballpath   = 'https://aur.archlinux.org' + tarballpath
-		self.tarballname   = tarballpath.split('/')[-1]
+		self.tarballpath   = utils.AUR_URL + tarballpath
 		self.reviewed      = False
 		self.review_passed = False
 		self.downloaded    = False
+		self.fetch_lock    = threading.Lock()
+		self.fetched       = threading.Event()  # set once get() is done, successful or not
+		self.fetch_failed  = False
+		self.prefetch      = None  # future of the background download of the upstream sources
+		self.download_size = 0
+		self.download_time = 0
 		self.built         = False
 		self.build_success = False
+		self.build_lock    = threading.Lock()  # split packages may be built concurrently
+		self.artifacts     = []
 		self.srcdir        = None
+		self.srcdest       = None  # SRCDEST of this package when using the source cache
+		self.git           = None  # only set when using the git-backend
+		self.commit        = None
+		self.tmpfiles      = []
 		self.stdoutlogfile = os.path.join(self.ctx.logdir, "{}-{}.stdout.log".format(self.name, self.version))
 		self.stderrlogfile = os.path.join(self.ctx.logdir, "{}-{}.stderr.log".format(self.name, self.version))
+		self.prefetchlogfile = os.path.join(self.ctx.logdir, "{}-{}.prefetch.log".format(self.name, self.version))
 		utils.logmsg(self.ctx.v, 3, "Instantiating source-pkg {}".format(self.name))
 
 
 	def get(self):
-		if not self.downloaded:
+		with self.fetch_lock:
+			if self.downloaded:
+				return
 			self.downloaded = True
 
-			# download
-			os.chdir(self.ctx.builddir)
-			r = requests.get(self.tarballpath)
-			with open(self.tarballname, 'wb') as tarball:
-				tarball.write(r.content)
+			try:
+				with profiling.span("fetch " + self.name, "fetch", backend=self.ctx.source_backend) as span:
+					if self.ctx.source_backend == 'git':
+						self.get_via_git()
+					else:
+						self.get_via_tarball()
+					span["bytes"] = self.download_size
+			finally:
+				self.fetched.set()
+
+
+	def get_via_tarball(self):
+		# download and extract in one go
+		start = time.monotonic()
+		with session.get_session().get(self.tarballpath, stream=True) as r:
+			r.raw.decode_content = True
+			stream = utils.CountingReader(r.raw)
+			if r.status_code != 200:
+				utils.logerr(None, "Couldn't download tarball for {}: HTTP status {}".format(self.name, r.status_code))
+				return self.discard_failed_fetch()
 
-			# extract
-			retval = subprocess.call(['tar', '-xzf', self.tarballname])
-			if retval != 0:
-				utils.logerr(None, "Couldn't extract tarball for {}".format(self.name))
+			try:
+				utils.extract_tarball(stream, self.ctx.builddir, self.name)
+			except (tarfile.TarError, utils.UnsafeTarballError, OSError) as e:
+				utils.logerr(None, "Couldn't extract tarball for {}: {}".format(self.name, e))
+				return self.discard_failed_fetch()
 
-			if os.path.exists(self.tarballname):
-				os.remove(self.tarballname)
-			self.srcdir = os.path.join(self.ctx.builddir, self.name)
+		self.download_size = stream.bytes
+		self.download_time = time.monotonic() - start
+		msg = "Fetched {}: {} bytes in {:.2f}s ({:.1f} KiB/s)"
+		utils.logmsg(self.ctx.v, 2, msg.format(self.name, self.download_size, self.download_time, self.download_size / 1024 / max(self.download_time, 1e-6)))
 
+		self.srcdir = os.path.join(self.ctx.builddir, self.name)
 
 
+	def discard_failed_fetch(self):
+		"""removes whatever a failed download left behind, so none of it is reviewed or built"""
+		self.fetch_failed = True
+		self.srcdir = None
+		path = os.path.join(self.ctx.builddir, self.name)
+		try:
+			if os.path.islink(path) or os.path.isfile(path):
+				os.remove(path)
+			elif os.path.isdir(path):
+				shutil.rmtree(path, onerror=lambda f, p, e: utils.delete_onerror(f, p, e))
+		except OSError as e:
+			utils.logerr(None, "Couldn't remove {}: {}".format(path, e))
 
-	def build(self, buildflags=[]):
-		if self.built:
-			return self.build_success
 
-		utils.logmsg(self.ctx.v, 0, "Building package {}".format(self.name))
+	def wait_fetched(self):
+		if not self.fetched.is_set():
+			utils.logmsg(self.ctx.v, 2, "Waiting for sources of {}".format(self.name))
+			self.fetched.wait()
 
-		os.chdir(self.srcdir)
-		self.built = True
 
-		with open(self.stdoutlogfile, 'w') as outlog, open(self.stderrlogfile, 'w') as errlog:
-			p = subprocess.Popen(['makepkg'] + buildflags, stdout=outlog, stderr=errlog)
-			r = p.wait()
+	def prefetch_sources(self):
+		"""starts downloading the upstream sources in the background, so the build does not have to"""
+		if self.prefetch is None and self.srcdir:
+			self.prefetch = prefetch_executor.submit(self.run_prefetch)
 
-		if r != 0:
-			with open(self.stdoutlogfile, 'a') as outlog, open(self.stderrlogfile, 'a') as errlog:
-				print("\nexit code: {}".format(r), file=outlog)
-				print("\nexit code: {}".format(r), file=errlog)
-			self.build_success = False
+
+	def run_prefetch(self):
+		start = time.monotonic()
+		with open(self.prefetchlogfile, 'w') as log, profiling.span("prefetch sources " + self.name, "fetch"):
+			r = subprocess.run(['makepkg', '--config', self.ctx.makepkgconf, '--verifysource'], stdout=log, stderr=subprocess.STDOUT, cwd=self.srcdir, env=self.makepkg_env())
+
+		if r.returncode == 0 and self.srcdest:
+			self.ctx.srccache.collect(self.name, self.srcdir, self.srcdest)
+
+		if r.returncode != 0:
+			utils.logmsg(self.ctx.v, 1, "Prefetching sources of {} failed, retrying when building (see {})".format(self.name, self.prefetchlogfile))
 			return False
-		else:
-			self.build_success = True
-			return True
+
+		utils.logmsg(self.ctx.v, 2, "Prefetched sources of {} in {:.2f}s".format(self.name, time.monotonic() - start))
+		return True
+
+
+	def get_via_git(self):
+		gitdir = os.path.join(self.ctx.gitdir, self.name + '.git')
+		self.git = gitsource.GitSource(self.name, gitdir, self.ctx.aur_git_url.format(self.name))
+
+		start = time.monotonic()
+		try:
+			self.commit = self.git.sync()
+			self.git.checkout(self.commit, self.ctx.builddir)
+		except (gitsource.GitSourceError, tarfile.TarError, utils.UnsafeTarballError, OSError) as e:
+			utils.logerr(None, "Couldn't get sources of {} via git: {}".format(self.name, e))
+			return self.discard_failed_fetch()
+
+		self.download_time = time.monotonic() - start
+		utils.logmsg(self.ctx.v, 2, "Synced {} via git to {} in {:.2f}s".format(self.name, self.commit, self.download_time))
+
+		self.srcdir = os.path.join(self.ctx.builddir, self.name)
+
+	def makepkg_env(self):
+		"""
+		Returns the environment for makepkg, which downloads upstream sources to
+		a SRCDEST filled from the source cache, if the cache is enabled.
+		"""
+		if self.srcdest is None and self.ctx.srccache:
+			self.srcdest = os.path.join(self.ctx.builddir, '.srcdest-' + self.name)
+			self.ctx.srccache.populate(self.name, self.srcdir, self.srcdest)
+
+		env = dict(os.environ)
+		if self.srcdest:
+			env['SRCDEST'] = self.srcdest
+		return env
+
+	def git_reference_file(self, fname):
+		"""
+		Provides fname as of the last reviewed commit as reference for
+		the review, returns None if there is no such reference.
+		"""
+		reviewed = self.git.reviewed_commit() if self.git else None
+		content = self.git.show_file(reviewed, fname) if reviewed else None
+		if content is None:
+			return None
+
+		return self.write_tmpfile(content, fname)
+
+	def write_tmpfile(self, content, fname):
+		"""writes content to a temporary file removed on cleanup, returns its path"""
+		fd, path = tempfile.mkstemp(prefix='.{}-reviewed-'.format(self.name), suffix='-' + fname, dir=self.ctx.builddir)
+		with os.fdopen(fd, 'wb') as f:
+			f.write(content)
+		self.tmpfiles.append(path)
+		return path
+
+
+	def build(self, buildflags=[]):
+		with self.build_lock:
+			if self.built:
+				return self.build_success
+
+			if self.prefetch:
+				# makepkg must not download the same sources concurrently
+				self.prefetch.result()
+
+			utils.logmsg(self.ctx.v, 0, "Building package {}".format(self.name))
+
+			self.built = True
+
+			with open(self.stdoutlogfile, 'w') as outlog, open(self.stderrlogfile, 'w') as errlog, profiling.span("makepkg " + self.name, "build"):
+				p = subprocess.Popen(['makepkg', '--config', self.ctx.makepkgconf] + buildflags, stdout=outlog, stderr=errlog, cwd=self.srcdir, env=self.makepkg_env())
+				r = p.wait()
+
+			if r == 0 and self.srcdest:
+				self.ctx.srccache.collect(self.name, self.srcdir, self.srcdest)
+
+			if r != 0:
+				with open(self.stdoutlogfile, 'a') as outlog, open(self.stderrlogfile, 'a') as errlog:
+					print("\nexit code: {}".format(r), file=outlog)
+					print("\nexit code: {}".format(r), file=errlog)
+				self.build_success = False
+				return False
+			else:
+				self.artifacts = self.find_artifacts()
+				self.build_success = True
+				return True
+
+	def find_artifacts(self):
+		"""returns the paths of all package files built from this source package"""
+		pkglist = makepkg.package_list(self.srcdir, self.ctx.makepkgconf)
+		if pkglist is None:
+			# makepkg cannot tell us, so look for the packages where they should be
+			env = makepkg.get_env(self.ctx.makepkgconf)
+			destdir = env.pkgdest or self.srcdir
+			pkglist = []
+			for fname in os.listdir(destdir):
+				pkgfile = pkgcache.parse_pkg_filename(fname)
+				if pkgfile and pkgfile.version == self.version and pkgfile.arch in [env.carch, 'any'] and pkgfile.ext == env.pkgext:
+					pkglist.append(os.path.join(destdir, fname))
+
+		return [path for path in pkglist if os.path.isfile(path)]
+
+	def artifacts_of(self, pkgname):
+		"""returns the paths of the package files built for pkgname, relevant for split packages"""
+		artifacts = []
+		for path in self.artifacts:
+			pkgfile = pkgcache.parse_pkg_filename(os.path.basename(path))
+			if pkgfile and pkgfile.name == pkgname:
+				artifacts.append(path)
+
+		return artifacts
 
 	def set_review_state(self, state):
 		"""This function is a helper to keep self.review clean and readable"""
@@ -134,31 +432,41 @@ class SourcePkg:
 		if self.reviewed:
 			return self.review_passed
 
-		os.chdir(self.srcdir)
+		with profiling.span("review " + self.name, "review") as span:
+			span["passed"] = self.review_files(via=via)
+		return self.review_passed
+
+	def review_files(self, via=None):
+		self.wait_fetched()
+		if self.fetch_failed:
+			utils.logmsg(self.ctx.v, 0, "{} cannot be reviewed: its sources could not be fetched".format(self.name))
+			return self.set_review_state(False)
 
 		def save_as_reviewed_file(fname):
 			"""
-			This function saves the given file in the directory for reviewed files
-			of the current package for later comparison.
+			This function saves the given file in the review database
+			for later comparison.
 			"""
-			d = os.path.join(self.ctx.revieweddir, self.name)
-			os.makedirs(d, exist_ok=True)
-			shutil.copyfile(fname, os.path.join(d, fname))
+			with open(os.path.join(self.srcdir, fname), 'rb') as f:
+				self.ctx.reviewdb.add_review(self.name, fname, f.read())
 
-		def hash_file(fname):
-			h = hashlib.sha256()
-			if os.path.exists(fname):
-				with open(fname, 'rb') as f:
-					h.update(f.read())
+		def reference_file(fname):
+			"""
+			This function provides the last positively reviewed version of the
+			given file to diff against, None if there is none.
+			"""
+			refhash = self.ctx.reviewdb.latest_hash(self.name, fname)
+			if refhash:
+				return self.write_tmpfile(self.ctx.reviewdb.content(refhash), fname)
 
-			return h.hexdigest()
+			return self.git_reference_file(fname)
 
 		def review_file(fname, via=None):
-			ref_file = os.path.join(self.ctx.revieweddir, self.name, fname)
-			# compare both reference PKGBUILD (if existent) and new PKGBUILD
+			path = os.path.join(self.srcdir, fname)
 
-			refhash = hash_file(ref_file)
-			newhash = hash_file(fname)
+			# compare both reference PKGBUILD (if existent) and new PKGBUILD
+			refhash = self.ctx.reviewdb.latest_hash(self.name, fname)
+			newhash = reviewstore.hash_file(path)
 
 			if refhash == newhash and not self.ctx.force_review:
 				msg = "{} of srcpkg {} passed review: already positively reviewed previously"
@@ -166,8 +474,9 @@ class SourcePkg:
 				return True
 			else:
 				# we need review, first diff it if reference exists
+				ref_file = reference_file(fname)
 				user_verdict = None
-				if os.path.exists(ref_file):
+				if ref_file:
 					user_verdict = 'd'  # diff
 				else:
 					user_verdict = 'e'  # edit (display with direct editing option)
@@ -179,9 +488,9 @@ class SourcePkg:
 					elif user_verdict in ['f', 's']:  # file failed review or was skipped
 						return False
 					elif user_verdict == 'e':  # user decides to edit
-						subprocess.call([os.environ.get('EDITOR') or 'nano', fname])
+						subprocess.call([os.environ.get('EDITOR') or 'nano', path])
 					elif user_verdict == 'd':  # user decides to diff
-						if os.path.exists(ref_file):
+						if ref_file:
 
 							termsize = shutil.get_terminal_size()
 							separator_width = termsize.columns - 2  # 1 whitespace padding on each side
@@ -191,17 +500,17 @@ class SourcePkg:
 							print()
 							if self.ctx.difftool:
 								try:
-									subprocess.call([self.ctx.difftool, fname, ref_file])
+									subprocess.call([self.ctx.difftool, path, ref_file])
 								except Exception as e:
 									utils.logerr(4, "Error using {} for diff: {}".format(self.ctx.difftool, e))
 							else:
-								with open(fname, 'r') as f:
+								with open(path, 'r') as f:
 									max_linelength = max([len(line) for line in f.read().strip().split('\n')])
 
 								diffwidth = min(2*max_linelength, os.get_terminal_size().columns)
 								diffcmd = ["colordiff", "--side-by-side", "--left-column", "--width={}".format(diffwidth)]
 
-								subprocess.call(diffcmd + [fname, ref_file])
+								subprocess.call(diffcmd + [path, ref_file])
 								print()
 
 								padding = " "*(int(diffwidth/2)-9)
@@ -239,17 +548,33 @@ class SourcePkg:
 		if not positively_reviewed:
 			return self.set_review_state(False)
 
-		installfiles = [f for f in os.listdir() if f.endswith('.install')]
+		installfiles = [f for f in os.listdir(self.srcdir) if f.endswith('.install')]
 		for installfile in installfiles:
-			if os.path.exists(installfile):
+			if os.path.exists(os.path.join(self.srcdir, installfile)):
 				positively_reviewed = review_file(installfile, via=via)
 				if not positively_reviewed:
 					return self.set_review_state(False)
 
+		if self.git and self.commit:
+			self.git.mark_reviewed(self.commit)
+
+		self.prefetch_sources()
 		return self.set_review_state(True)
 
 
 	def cleanup(self):
+		with profiling.span("cleanup " + self.name, "cleanup"):
+			self.remove_files()
+
+	def remove_files(self):
+		if self.prefetch:
+			self.prefetch.result()
+
+		for path in self.tmpfiles:
+			if os.path.exists(path):
+				os.remove(path)
+		self.tmpfiles = []
+
 		if self.srcdir:
 			try:
 				shutil.rmtree(self.srcdir, onerror=lambda f, p, e: utils.delete_onerror(f, p, e))
@@ -258,6 +583,10 @@ class SourcePkg:
 
 			self.srcdir = None  # if we couldn't remove it, we can't next time, so we ignore the exception and continue
 
+		if self.srcdest:
+			shutil.rmtree(self.srcdest, ignore_errors=True)  # only links into the source cache are left in there
+			self.srcdest = None
+
 
 class Package:
 
@@ -304,76 +633,44 @@ class Package:
 
 		utils.logmsg(self.ctx.v, 3, "Instantiating package {}".format(self.name))
 
-		self.pkgdata = None
+		self.depnames          = []
+		self.makedepnames      = []
+		self.version_latest    = None
+		self.pkgdata           = None
+		self.in_aur            = None
 		if aurdata:
-			self.pkgdata = aurdata
-		else:
-			try:
-				self.pkgdata = utils.query_aur("info", self.name, single=True, ignore_ood=ctx.ignore_ood)
-			except utils.APIError as e:
+			self.set_aurdata(aurdata)
 
-				msg = "Dependency unsatisfiable via AUR, repos or installed packages: {}"
-				if e.type == 'ratelimit':
-					msg = "Dependency unsatisfiable due to rate limit on AUR-API, try again tomorrow: {}"
-				elif e.type == 'unavailable':
-					msg = "Dependency unsatisfiable due to unavailability of AUR-API, try again later: {}"
-
-				raise utils.UnsatisfiableDependencyError(msg.format(self.name))
 
+	def set_aurdata(self, aurdata):
+		"""
+		Completes the package with the information obtained from the AUR (None if
+		not found there), done separately so that the resolver can query the AUR
+		for all packages of one level of the dependency graph at once.
+		"""
+		self.pkgdata = aurdata
 		self.in_aur = not self.in_repos and self.pkgdata
 
-		utils.logmsg(self.ctx.v, 4, 'Package details: {}; {}; {}; {}'.format(name, "installed" if self.installed else "not installed", "in repos" if self.in_repos else "not in repos", "in AUR" if self.in_aur else "not in AUR"))
+		utils.logmsg(self.ctx.v, 4, 'Package details: {}; {}; {}; {}'.format(self.name, "installed" if self.installed else "not installed", "in repos" if self.in_repos else "not in repos", "in AUR" if self.in_aur else "not in AUR"))
 
 		if self.in_aur:
 			self.version_latest    = self.pkgdata['Version']
 
-			depnames = [pn.split('>=')[0].split('=')[0] for pn in self.pkgdata.get("Depends") or []]
-			makedepnames  = [pn.split('>=')[0].split('=')[0] for pn in self.pkgdata.get("MakeDepends") or []]
-			makedepnames += [pn.split('>=')[0].split('=')[0] for pn in self.pkgdata.get("CheckDepends") or []]
-
-			_, _, _, aurdata = utils.check_in_aur(depnames + makedepnames)
-
-			try:
-				with concurrent.futures.ThreadPoolExecutor(max_workers=10) as e:
-					dep_pkgs_parser, makedep_pkgs_parser = [], []
-					for depname in depnames:
-						aurpkgdata = aurdata[depname] if depname in aurdata else None
-						dep_pkgs_parser.append(e.submit(parse_dep_pkg, depname, self.ctx, self, aurpkgdata))
-
-					for makedepname in makedepnames:
-						aurpkgdata = aurdata[makedepname] if makedepname in aurdata else None
-						makedep_pkgs_parser.append(e.submit(parse_dep_pkg, makedepname, self.ctx, self, aurpkgdata))
-
-					self.deps = [p.result() for p in dep_pkgs_parser]
-					self.makedeps = [p.result() for p in makedep_pkgs_parser]
-			except utils.UnsatisfiableDependencyError as e:
-				raise utils.UnsatisfiableDependencyError(str(e) + " for {}".format(self.name))
-			except Exception as e:
-				raise e
+			self.depnames      = [strip_version(pn) for pn in self.pkgdata.get("Depends") or []]
+			self.makedepnames  = [strip_version(pn) for pn in self.pkgdata.get("MakeDepends") or []]
+			self.makedepnames += [strip_version(pn) for pn in self.pkgdata.get("CheckDepends") or []]
 
 			if "OptDepends" in self.pkgdata:
 				for pkg in self.pkgdata["OptDepends"]:
 					self.optdeps.append(pkg)
 
-			parse_src_pkg(self.pkgdata["PackageBase"], self.pkgdata["Version"], self.pkgdata["URLPath"], ctx=ctx)
-
+			self.srcpkg = parse_src_pkg(self.pkgdata["PackageBase"], self.pkgdata["Version"], self.pkgdata["URLPath"], ctx=self.ctx)
 
 		elif not self.in_repos and not self.installed:
 			# not in AUR, not in repos (not even provided by another package), not installed: well, little we can do...
 			raise utils.UnsatisfiableDependencyError("Dependency unsatisfiable via AUR, repos or installed packages: {}".format(self.name))
 
 
-	def get_src(self):
-		if self.in_aur:
-			self.srcpkg = srcpkg_store[self.pkgdata["PackageBase"]]
-			self.srcpkg.get()
-
-		e = concurrent.futures.ThreadPoolExecutor(max_workers=10)
-		for d in self.deps + self.makedeps:
-			e.submit(d.get_src)
-		e.shutdown(wait=True)
-
-
 	def review(self):
 		utils.logmsg(self.ctx.v, 3, "reviewing {}".format(self.name))
 
@@ -405,7 +702,11 @@ class Package:
 		return self.srcpkg.review(via=self)
 
 
-	def build(self, buildflags=['-Cdf'], recursive=False, dependency=False):
+	def build(self, buildflags=['-Cdf'], dependency=False):
+		"""
+		Builds this package only, its deps have to be built and installed before
+		(the layers of the DependencyGraph are built one after the other).
+		"""
 
 		if dependency and self.installed:
 			# if this is a dependency and already installed, we do not bother,
@@ -418,12 +719,6 @@ class Package:
 			utils.logerr(None, "{}, aborting this subtree".format(msg))
 			return False
 
-		if recursive:
-			for d in self.deps:
-				succeeded = d.build(buildflags=buildflags, recursive=True, dependency=True)
-				if not succeeded:
-					return False  # one dep fails, the entire branch fails immediately, software will not be runnable
-
 		if self.in_repos or (self.installed and not self.in_aur):
 			return True
 
@@ -456,67 +751,27 @@ class Package:
 
 			return False
 
-		pkgext_makepkgconf = subprocess.getoutput("bash -c 'source {} && echo $PKGEXT'".format(self.ctx.makepkgconf))
-		pkgext_env = os.environ.get('PKGEXT')
-
-		pkgext = pkgext_env or pkgext_makepkgconf or '.pkg.tar.xz'
-		fullpkgnames = []
-		fullpkgname_x86_64_tmpl = "{}-{}-x86_64{}"
-		fullpkgname_any_tmpl = "{}-{}-any{}"
-		if fullpkgname_x86_64_tmpl.format(self.name, self.version_latest, pkgext) in os.listdir(self.srcpkg.srcdir):
-			fullpkgnames.append(fullpkgname_x86_64_tmpl.format(self.name, self.version_latest, pkgext))
-		elif fullpkgname_any_tmpl.format(self.name, self.version_latest, pkgext) in os.listdir(self.srcpkg.srcdir):
-			fullpkgnames.append(fullpkgname_any_tmpl.format(self.name, self.version_latest, pkgext))
-		else:
-			fullpkgnames = [p for p in os.listdir(self.srcpkg.srcdir) if p.endswith(pkgext)]
-
-		if fullpkgnames:
-			for fpn in fullpkgnames:
+		artifacts = self.srcpkg.artifacts_of(self.name)
+		if artifacts:
+			index = pkgcache.get_index(self.ctx.cachedir)
+			for path in artifacts:
+				fpn = os.path.basename(path)
 				self.built_pkgs.append(fpn)
 				if os.path.exists(os.path.join(self.ctx.cachedir, fpn)):
 					if not os.path.isfile(os.path.join(self.ctx.cachedir, fpn)):
-						utils.logerr(None, 0, "Something (that's not a file) is shadowing package {} in cache directory {}".format((fpn), self.cachedir))
+						utils.logerr(None, "Something (that's not a file) is shadowing package {} in cache directory {}".format(fpn, self.ctx.cachedir))
 				else:
-					shutil.move(os.path.join(self.srcpkg.srcdir, fpn), self.ctx.cachedir)
+					shutil.move(path, self.ctx.cachedir)
+					index.add(fpn)
 		else:
 			utils.logerr(None, "No package file found in builddir for {}, aborting this subtree".format(self.name))
 			return False
 
 		return True
 
-	def get_repodeps(self):
-		if self.in_repos:
-			return set()  # pacman will take care of repodep-tree
-		else:
-			rdeps = set()
-			for d in self.deps:
-				if d.in_repos:
-					rdeps.add(d)
-				else:
-					rdeps.union(d.get_repodeps())
-			return rdeps
-
-	def get_deps(self):
-		if self.in_repos:
-			return set()  # pacman will take care of repodep-tree
-		else:
-			deps = set(self.deps)
-			for d in self.deps:
-				deps.union(d.get_deps())
-			return deps
-
-	def get_makedeps(self):
-		if self.in_repos:
-			return set()
-		else:
-			makedeps = set(self.makedeps)
-			for d in self.deps:
-				makedeps.union(d.get_makedeps())
-			return makedeps
-
 	def check_makedeps_installed(self):
-		md = self.get_makedeps()
-		for m in md:
+		# deps are built and installed in earlier batches, so only the own makedeps matter
+		for m in self.makedeps:
 		# for every makedep...
 			if not m.installed:
 			# ...if it has not been installed anyways...
@@ -526,12 +781,6 @@ class Package:
 
 		return True
 
-	def get_built_pkgs(self):
-		pkgs = set(self.built_pkgs)
-		for d in self.deps:
-			pkgs.union(d.get_built_pkgs())
-		return pkgs
-
 	def get_optdeps(self):
 		optdeps = []
 		for d in self.deps:
@@ -1,84 +1,223 @@
 #!/usr/bin/env python3
 
-import subprocess, os, pyalpm, pycman
-from distutils import spawn
+import subprocess, re, shutil
 from threading import Lock
+from blinky import profiling
 
-handle = pycman.config.init_with_config('/etc/pacman.conf') #pyalpm.Handle("/", "/var/lib/pacman")
-ldb_lock, ldb = Lock(), handle.get_localdb()
-sdbs = [(Lock(), sdb) for sdb in handle.get_syncdbs()]
+DEFAULT_CONFIG = '/etc/pacman.conf'
+config_path    = DEFAULT_CONFIG  # can be changed before libalpm is first used
 
-devnull = open(os.devnull, 'w')
-sudo = spawn.find_executable("sudo")
+# libalpm is only initialized on first use of handle, ldb or sdbs, so that
+# commands not needing it do not pay for parsing pacman.conf and opening the dbs
+handle_lock = Lock()
 
-def refresh():
+def init():
 	global handle, ldb, sdbs
-	handle = pycman.config.init_with_config('/etc/pacman.conf') #pyalpm.Handle("/", "/var/lib/pacman")
-	ldb, sdbs = handle.get_localdb(), [(Lock(), sdb) for sdb in handle.get_syncdbs()]
+	with handle_lock:
+		if 'handle' not in globals():
+			with profiling.span("libalpm init", "alpm"):
+				import pycman
+				h = pycman.config.init_with_config(config_path) #pyalpm.Handle("/", "/var/lib/pacman")
+				ldb, sdbs = h.get_localdb(), h.get_syncdbs()
+			handle = h
+
+def __getattr__(name):
+	if name in ['handle', 'ldb', 'sdbs']:
+		init()
+		return globals()[name]
+	raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+def split_dependency(dep):
+	"""splits 'foo>=1.2' into ('foo', '>=', '1.2'), 'foo' into ('foo', None, None)"""
+	m = re.match('^(.*?)(>=|<=|=|<|>)(.*)$', dep)
+	if m:
+		return m.group(1), m.group(2), m.group(3)
+	return dep, None, None
+
+
+def vercmp(a, b):
+	import pyalpm
+	return pyalpm.vercmp(a, b)
+
+
+def version_satisfies(pkgversion, op, version):
+	if op is None:
+		return True
+
+	cmp = vercmp(pkgversion, version)
+	return {'=': cmp == 0, '>=': cmp >= 0, '<=': cmp <= 0, '>': cmp > 0, '<': cmp < 0}[op]
+
+
+class SatisfierIndex:
+	"""
+	Immutable index over the packages of one database, mapping package names
+	and provided names to the respective packages. Once built it is only
+	read, so lookups need no locking; refresh() replaces the indices as a whole.
+	"""
+
+	def __init__(self, db):
+		by_name, providers = {}, {}
+		for pkg in db.pkgcache:
+			by_name.setdefault(pkg.name, []).append(pkg)
+			for provision in pkg.provides:
+				name, _, version = provision.partition('=')
+				providers.setdefault(name, []).append((pkg, version or None))
+
+		self.by_name   = by_name
+		self.providers = providers
+
+	def find_satisfier(self, dep):
+		name, op, version = split_dependency(dep)
+		for pkg in self.by_name.get(name, []):
+			if version_satisfies(pkg.version, op, version):
+				return pkg
+
+		for pkg, provided_version in self.providers.get(name, []):
+			# unversioned provisions cannot satisfy versioned dependencies
+			if op is None or (provided_version and version_satisfies(provided_version, op, version)):
+				return pkg
+
+		return None
+
+
+# the indices are built on first use, only construction is locked
+indices_lock  = Lock()
+local_index   = None
+sync_indices  = None
+
+def get_local_index():
+	global local_index
+	index = local_index
+	if index is None:
+		with indices_lock:
+			if local_index is None:
+				init()
+				with profiling.span("index local db", "alpm"):
+					local_index = SatisfierIndex(ldb)
+			index = local_index
+	return index
+
+def get_sync_indices():
+	global sync_indices
+	indices = sync_indices
+	if indices is None:
+		with indices_lock:
+			if sync_indices is None:
+				init()
+				with profiling.span("index sync dbs", "alpm"):
+					sync_indices = tuple(SatisfierIndex(sdb) for sdb in sdbs)
+			indices = sync_indices
+	return indices
+
+def refresh():
+	global handle, local_handle, ldb, sdbs, local_index, sync_indices
+	import pycman
+	new_handle = pycman.config.init_with_config(config_path) #pyalpm.Handle("/", "/var/lib/pacman")
+	new_ldb, new_sdbs = new_handle.get_localdb(), new_handle.get_syncdbs()
+	new_local_index = SatisfierIndex(new_ldb)
+	new_sync_indices = tuple(SatisfierIndex(sdb) for sdb in new_sdbs)
+
+	with indices_lock:
+		handle, ldb, sdbs = new_handle, new_ldb, new_sdbs
+		local_handle = new_handle
+		local_index, sync_indices = new_local_index, new_sync_indices
+
+def refresh_local():
+	"""
+	Reloads only the local db after a transaction, the sync dbs do not change
+	by installing or removing packages.
+	"""
+	global local_handle, ldb, local_index
+	if 'handle' not in globals():
+		return  # nothing loaded yet, the next use loads the current state anyways
+
+	import pyalpm
+	with profiling.span("reload local db", "alpm"):
+		# the db and its packages are only valid as long as their handle lives, so it is kept
+		new_handle = pyalpm.Handle(handle.root, handle.dbpath)
+		new_ldb = new_handle.get_localdb()
+		new_local_index = SatisfierIndex(new_ldb)
+
+	with indices_lock:
+		local_handle, ldb, local_index = new_handle, new_ldb, new_local_index
+
+def pacman_command(operation):
+	cmdlist = ['pacman', operation]
+	if config_path != DEFAULT_CONFIG:
+		cmdlist += ['--config', config_path]
+	return cmdlist
 
 def execute_privileged(cmdlist):
-	if sudo:
-		return subprocess.call(["sudo"] + cmdlist)
-	else:
-		return subprocess.call(["su", "-c"] + [" ".join(cmdlist)])
+	with profiling.span(" ".join(cmdlist[:2]), "install", cmd=cmdlist):
+		if shutil.which("sudo"):
+			return subprocess.call(["sudo"] + cmdlist)
+		else:
+			return subprocess.call(["su", "-c"] + [" ".join(cmdlist)])
 
 def find_local_satisfier(pkgname):
-	ldb_lock.acquire()
-	try:
-		satisfier = pyalpm.find_satisfier(ldb.pkgcache, pkgname)
-	finally:
-		ldb_lock.release()
-
-	return satisfier
+	profiling.count("alpm_local_lookups")
+	return get_local_index().find_satisfier(pkgname)
 
 def find_satisfier_in_syncdbs(pkgname):
-	for lock, db in sdbs:
-		lock.acquire()
-		try:
-			s = pyalpm.find_satisfier(db.pkgcache, pkgname)
-		finally:
-			lock.release()
-
+	profiling.count("alpm_sync_lookups")
+	for index in get_sync_indices():
+		s = index.find_satisfier(pkgname)
 		if s:
 			return s
 
 	return None
 
 
+def get_installed_versions():
+	"""returns (name, version) of all installed packages"""
+	return set((pkg.name, pkg.version) for pkgs in get_local_index().by_name.values() for pkg in pkgs)
+
+
 def get_foreign_package_versions():
-	pkgs = subprocess.getoutput("pacman -Qm")
-	foreign_package_versions = {}
-	for p in pkgs.strip().split("\n"):
-		name, version = p.split()
-		foreign_package_versions[name] = version
-	return foreign_package_versions
+	"""returns {name: version} of all installed packages not found in the sync dbs, like pacman -Qm"""
+	sync_names = set(name for index in get_sync_indices() for name in index.by_name)
+	return {pkg.name: pkg.version for pkgs in get_local_index().by_name.values() for pkg in pkgs if pkg.name not in sync_names}
 
 def install_repo_packages(pkgs, asdeps=True):
 	if len(pkgs) > 0:
-		cmdlist = ['pacman', '-S']
+		cmdlist = pacman_command('-S')
 		if asdeps:
 			cmdlist += ['--asdeps']
 		cmdlist += [str(p) for p in pkgs]
 
 		ret = execute_privileged(cmdlist)
-		refresh()
+		refresh_local()
 		return ret == 0
 
-def install_package_files(pkgs, asdeps):
+def install_package_files(pkgs, asdeps, mark_asdeps=()):
+	"""
+	Installs the given package files in a single transaction. Without asdeps,
+	the packages named in mark_asdeps are marked as dependencies afterwards,
+	so packages with different install reasons need no separate transactions.
+	Only fails if the installation failed: the packages are installed even if
+	marking them fails, which is merely warned about.
+	"""
 	if len(pkgs) > 0:
-		cmdlist = ['pacman', '-U']
+		cmdlist = pacman_command('-U')
 		if asdeps:
 			cmdlist += ['--asdeps']
 		cmdlist += [str(p) for p in pkgs]
 
 		ret = execute_privileged(cmdlist)
-		refresh()
+		if ret == 0 and mark_asdeps and not asdeps:
+			if execute_privileged(pacman_command('-D') + ['--asdeps'] + sorted(mark_asdeps)) != 0:
+				from blinky import utils
+				msg = "Packages were installed, but could not be marked as dependencies: {}"
+				utils.logerr(None, msg.format(", ".join(sorted(mark_asdeps))))
+
+		refresh_local()
 		return ret == 0
 
 def remove_packages(pkgs):
 	if len(pkgs) > 0:
-		cmdlist = ['pacman', '-Rsn'] + [str(p) for p in pkgs]
+		cmdlist = pacman_command('-Rsn') + [str(p) for p in pkgs]
 
 		ret = execute_privileged(cmdlist)
-		refresh()
+		refresh_local()
 		return ret == 0
@@ -0,0 +1,153 @@
+import os, time, threading, functools
+from collections import namedtuple
+
+PkgFile = namedtuple('PkgFile', ['filename', 'name', 'version', 'arch', 'ext'])
+CacheEntry = namedtuple('CacheEntry', ['pkgfile', 'size', 'mtime', 'sigs'])
+
+
+def parse_pkg_filename(fname):
+	"""
+	Parses a package filename like 'foo-bar-1:2.0-1-x86_64.pkg.tar.zst'
+	into its parts, returns None for everything that is not a package.
+	"""
+	base, sep, ext = fname.partition('.pkg.tar')
+	if not sep or ext.endswith('.sig'):
+		return None
+
+	parts = base.rsplit('-', 3)
+	if len(parts) != 4 or not all(parts):
+		return None
+
+	name, pkgver, pkgrel, arch = parts
+	return PkgFile(fname, name, "{}-{}".format(pkgver, pkgrel), arch, sep + ext)
+
+
+class PkgCacheIndex:
+	"""
+	Index over the package files in blinky's package cache. The cache directory
+	is scanned once, afterwards the index is kept up to date via add() and
+	remove(), so lookups never have to touch the directory again.
+	"""
+
+	def __init__(self, cachedir):
+		self.cachedir = cachedir
+		self.lock     = threading.Lock()
+		self.by_key   = {}  # (name, version) -> {filename: PkgFile}
+
+		for fname in os.listdir(cachedir):
+			self.add(fname)
+
+	def add(self, fname):
+		pkgfile = parse_pkg_filename(fname)
+		if pkgfile:
+			with self.lock:
+				self.by_key.setdefault((pkgfile.name, pkgfile.version), {})[fname] = pkgfile
+
+		return pkgfile
+
+	def remove(self, fname):
+		pkgfile = parse_pkg_filename(fname)
+		if pkgfile:
+			with self.lock:
+				files = self.by_key.get((pkgfile.name, pkgfile.version), {})
+				files.pop(fname, None)
+				if not files:
+					self.by_key.pop((pkgfile.name, pkgfile.version), None)
+
+	def lookup(self, name, version):
+		"""returns the filenames of all cached builds of exactly this package and version"""
+		with self.lock:
+			return sorted(self.by_key.get((name, version), {}))
+
+	def pkgfiles(self):
+		with self.lock:
+			return [pkgfile for files in self.by_key.values() for pkgfile in files.values()]
+
+
+_indices      = {}
+_indices_lock = threading.Lock()
+
+def get_index(cachedir):
+	with _indices_lock:
+		if cachedir not in _indices:
+			_indices[cachedir] = PkgCacheIndex(cachedir)
+
+		return _indices[cachedir]
+
+
+def scan(cachedir):
+	"""
+	Scans the cache directory in a single pass. Returns the package files as
+	CacheEntry, with signatures attached to their package file, and the names
+	of everything else found in there.
+	"""
+	entries, sigs, others = {}, {}, []
+	with os.scandir(cachedir) as it:
+		for entry in it:
+			if not entry.is_file(follow_symlinks=False):
+				others.append(entry.name)
+				continue
+
+			st = entry.stat(follow_symlinks=False)
+			if entry.name.endswith('.sig'):
+				sigs[entry.name[:-len('.sig')]] = (entry.name, st.st_size)
+				continue
+
+			pkgfile = parse_pkg_filename(entry.name)
+			if pkgfile:
+				entries[entry.name] = CacheEntry(pkgfile, st.st_size, st.st_mtime, ())
+			else:
+				others.append(entry.name)
+
+	for fname, (signame, size) in sigs.items():
+		if fname in entries:
+			entries[fname] = entries[fname]._replace(size=entries[fname].size + size, sigs=(signame,))
+		else:
+			others.append(signame)
+
+	return list(entries.values()), others
+
+
+def plan_gc(entries, installed, vercmp, keep_versions=None, max_size=None, max_age=None, now=None):
+	"""
+	Decides which package files to remove from the cache, returns a dict mapping
+	the respective entries to the reason. Installed versions, given as set of
+	(name, version), are always kept. Without any limit given, everything else
+	is removed, otherwise only what is
+
+	 - older than the keep_versions most recent versions of its package,
+	 - older than max_age seconds, or
+	 - least recently used while the cache exceeds max_size bytes.
+	"""
+	now = now or time.time()
+	if keep_versions is None and max_size is None and max_age is None:
+		keep_versions = 0
+
+	by_name = {}
+	for entry in entries:
+		by_name.setdefault(entry.pkgfile.name, []).append(entry)
+
+	remove, survivors = {}, []
+	for name, pkgentries in by_name.items():
+		versions = sorted(set(e.pkgfile.version for e in pkgentries), key=functools.cmp_to_key(vercmp), reverse=True)
+		recent = set(versions if keep_versions is None else versions[:keep_versions])
+
+		for entry in pkgentries:
+			if (name, entry.pkgfile.version) in installed:
+				continue
+			elif entry.pkgfile.version not in recent:
+				remove[entry] = "not installed" if keep_versions == 0 else "not among the {} most recent versions".format(keep_versions)
+			elif max_age is not None and now - entry.mtime > max_age:
+				remove[entry] = "older than {:.0f} days".format(max_age / 86400)
+			else:
+				survivors.append(entry)
+
+	if max_size is not None:
+		total = sum(e.size for e in entries if e not in remove)
+		for entry in sorted(survivors, key=lambda e: e.mtime):
+			if total <= max_size:
+				break
+			remove[entry] = "cache exceeds {:.1f} MiB".format(max_size / 1024**2)
+			total -= entry.size
+
+	return remove
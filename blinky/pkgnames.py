@@ -0,0 +1,108 @@
+import os, sys, time, mmap, gzip, tempfile, subprocess
+from blinky import utils
+
+# the complete list of AUR package names is refreshed in the background
+# once the local copy is older than this
+MAX_AGE = 24 * 3600
+
+# a refresh that did not finish within this time is considered dead
+REFRESH_TIMEOUT = 600
+
+
+def index_path():
+	return os.path.join(utils.get_cache_dir(), 'pkgnames')
+
+
+def refresh_index():
+	"""
+	Downloads the list of all AUR package names and stores it sorted, one name
+	per line, so that prefix lookups are a binary search on the file.
+	"""
+	from blinky import session
+	r = session.get_session().get(utils.AUR_URL + "/packages.gz")
+	r.raise_for_status()
+
+	# depending on the server, the list might arrive already decompressed
+	content = r.content
+	if content[:2] == b'\x1f\x8b':
+		content = gzip.decompress(content)
+
+	names = sorted(set(line.strip() for line in content.split(b'\n') if line.strip() and not line.startswith(b'#')))
+
+	path = index_path()
+	fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.pkgnames-')
+	with os.fdopen(fd, 'wb') as f:
+		f.write(b'\n'.join(names) + b'\n')
+	os.replace(tmppath, path)
+
+
+def refresh_index_in_background():
+	"""starts a detached blinky refreshing the index, unless one is already at it"""
+	marker = index_path() + '.refreshing'
+	try:
+		if time.time() - os.path.getmtime(marker) < REFRESH_TIMEOUT:
+			return
+		os.remove(marker)
+	except OSError:
+		pass
+
+	try:
+		os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+	except FileExistsError:
+		return
+
+	subprocess.Popen([sys.executable, sys.argv[0], '--refresh-completion-index'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def finish_background_refresh():
+	marker = index_path() + '.refreshing'
+	if os.path.exists(marker):
+		os.remove(marker)
+
+
+def find_prefix(mm, prefix):
+	"""returns the offset of the first line in the sorted mmap not smaller than prefix"""
+	lo, hi = 0, len(mm)
+	while lo < hi:
+		mid = (lo + hi) // 2
+		start = mm.rfind(b'\n', 0, mid) + 1
+		end = mm.find(b'\n', start)
+		if end == -1:
+			end = len(mm)
+
+		if mm[start:end] < prefix:
+			lo = end + 1
+		else:
+			hi = start
+
+	return lo
+
+
+def complete(prefix):
+	"""returns all AUR package names starting with prefix, without touching the network if possible"""
+	path = index_path()
+	if not os.path.exists(path):
+		refresh_index()
+	elif time.time() - os.path.getmtime(path) > MAX_AGE:
+		refresh_index_in_background()
+
+	if os.path.getsize(path) == 0:
+		return []
+
+	prefix = prefix.encode()
+	matches = []
+	with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		pos = find_prefix(mm, prefix)
+		while pos < len(mm):
+			end = mm.find(b'\n', pos)
+			if end == -1:
+				end = len(mm)
+
+			name = mm[pos:end]
+			if not name.startswith(prefix):
+				break
+
+			matches.append(name.decode())
+			pos = end + 1
+
+	return matches
@@ -0,0 +1,61 @@
+import os, json, time, threading, contextlib
+
+# records spans and counters of a run in the Chrome trace event format, so that
+# traces can be inspected with chrome://tracing or Perfetto and compared between runs;
+# nothing is recorded unless enable() was called
+
+enabled   = False
+events    = []
+counters  = {}
+lock      = threading.Lock()
+_start    = time.perf_counter()
+_nullspan = contextlib.nullcontext({})
+
+
+def enable():
+	global enabled
+	enabled = True
+
+
+def _now():
+	return (time.perf_counter() - _start) * 1e6  # trace event timestamps are in microseconds
+
+
+@contextlib.contextmanager
+def _span(name, cat, args):
+	start = _now()
+	try:
+		yield args  # further arguments can be added while the span is open, e.g. byte counts
+	finally:
+		event = {"name": name, "cat": cat, "ph": "X", "ts": start, "dur": _now() - start,
+				"pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+		with lock:
+			events.append(event)
+
+
+def span(name, cat, **args):
+	"""
+	Context manager recording how long the enclosed block takes, yields a dict
+	for arguments to record along with it.
+	"""
+	if not enabled:
+		return _nullspan
+	return _span(name, cat, args)
+
+
+def count(name, value=1):
+	"""adds value to the counter name"""
+	if not enabled:
+		return
+
+	with lock:
+		counters[name] = counters.get(name, 0) + value
+		events.append({"name": name, "ph": "C", "ts": _now(), "pid": os.getpid(), "args": {name: counters[name]}})
+
+
+def write(path):
+	with lock:
+		trace = {"traceEvents": list(events), "displayTimeUnit": "ms", "otherData": {"counters": dict(counters)}}
+
+	with open(path, 'w') as f:
+		json.dump(trace, f)
@@ -0,0 +1,105 @@
+import os, time, sqlite3, hashlib, threading
+
+schema = """
+CREATE TABLE IF NOT EXISTS blobs (
+	sha256      TEXT PRIMARY KEY,
+	content     BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reviews (
+	id          INTEGER PRIMARY KEY AUTOINCREMENT,
+	pkgbase     TEXT NOT NULL,
+	filename    TEXT NOT NULL,
+	sha256      TEXT NOT NULL REFERENCES blobs(sha256),
+	reviewed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_by_file ON reviews (pkgbase, filename);
+CREATE TABLE IF NOT EXISTS meta (
+	key         TEXT PRIMARY KEY,
+	value       TEXT
+);
+"""
+
+# SQLite limits the number of parameters per statement
+MAX_PARAMS = 500
+
+
+def hash_file(path):
+	h = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(65536), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+class ReviewStore:
+	"""
+	Keeps all positively reviewed files in a single SQLite database: the hash of
+	every reviewed version per package base and filename, plus the contents
+	(deduplicated by their hash) to diff new versions against. Reviews can be
+	shared between machines by copying the database file.
+	"""
+
+	def __init__(self, path):
+		self.path   = path
+		self.lock   = threading.Lock()
+		self.latest = {}  # (pkgbase, filename) -> sha256, filled by prefetch()
+		self.db     = sqlite3.connect(path, check_same_thread=False)
+		self.db.executescript(schema)
+
+	def prefetch(self, pkgbases):
+		"""looks up the latest reviews of all files of the given package bases at once"""
+		pkgbases = list(pkgbases)
+		with self.lock:
+			for i in range(0, len(pkgbases), MAX_PARAMS):
+				chunk = pkgbases[i:i+MAX_PARAMS]
+				for pkgbase in chunk:
+					self.latest.setdefault(pkgbase, {})
+
+				query = """SELECT pkgbase, filename, sha256 FROM reviews WHERE id IN
+				           (SELECT max(id) FROM reviews WHERE pkgbase IN ({}) GROUP BY pkgbase, filename)"""
+				for pkgbase, filename, sha256 in self.db.execute(query.format(",".join("?" * len(chunk))), chunk):
+					self.latest[pkgbase][filename] = sha256
+
+	def latest_hash(self, pkgbase, filename):
+		"""returns the hash of the last positively reviewed version of the file, None if there is none"""
+		if pkgbase not in self.latest:
+			self.prefetch([pkgbase])
+		return self.latest[pkgbase].get(filename)
+
+	def content(self, sha256):
+		with self.lock:
+			row = self.db.execute("SELECT content FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+		return row[0] if row else None
+
+	def add_review(self, pkgbase, filename, content, reviewed_at=None):
+		sha256 = hashlib.sha256(content).hexdigest()
+		with self.lock, self.db:
+			self.db.execute("INSERT OR IGNORE INTO blobs (sha256, content) VALUES (?, ?)", (sha256, content))
+			self.db.execute("INSERT INTO reviews (pkgbase, filename, sha256, reviewed_at) VALUES (?, ?, ?, ?)",
+					(pkgbase, filename, sha256, reviewed_at or time.time()))
+			if pkgbase in self.latest:
+				self.latest[pkgbase][filename] = sha256
+
+	def import_reviewed_dir(self, revieweddir):
+		"""
+		Imports the reviews of the directory-based format used by earlier
+		versions of blinky (<revieweddir>/<pkgbase>/<filename>), once.
+		"""
+		with self.lock:
+			if self.db.execute("SELECT value FROM meta WHERE key = 'imported_revieweddir'").fetchone():
+				return
+
+		if os.path.isdir(revieweddir):
+			for pkgbase in sorted(os.listdir(revieweddir)):
+				pkgdir = os.path.join(revieweddir, pkgbase)
+				if not os.path.isdir(pkgdir):
+					continue
+
+				for filename in sorted(os.listdir(pkgdir)):
+					path = os.path.join(pkgdir, filename)
+					if os.path.isfile(path):
+						with open(path, 'rb') as f:
+							self.add_review(pkgbase, filename, f.read(), reviewed_at=os.path.getmtime(path))
+
+		with self.lock, self.db:
+			self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_revieweddir', ?)", (revieweddir,))
@@ -0,0 +1,109 @@
+import concurrent.futures, heapq, itertools, threading
+from blinky import utils
+
+
+class FetchScheduler:
+	"""
+	Fetches the sources of all source packages of a run with at most `jobs`
+	downloads at a time. Every source package is fetched only once, no matter
+	how often it is requested, and deeper parts of the dependency graph are
+	fetched first, as that is where the review starts.
+	"""
+
+	def __init__(self, ctx, jobs=4):
+		self.ctx      = ctx
+		self.jobs     = max(jobs, 1)
+		self.lock     = threading.Lock()
+		self.queue    = []  # heap of (-depth, sequence number, srcpkg)
+		self.futures  = {}  # srcpkg -> future of its fetch
+		self.seq      = itertools.count()
+		self.workers  = 0
+		self.inflight = 0
+
+	def fetch_graph(self, packages):
+		"""
+		Schedules fetching the sources of the given packages and their entire
+		dependency graph, returns the futures of the respective fetches.
+		"""
+		depths, level, depth = {}, list(packages), 0
+		while level:
+			next_level = []
+			for p in level:
+				if p not in depths:
+					depths[p] = depth
+					next_level += p.deps + p.makedeps
+			level, depth = next_level, depth + 1
+
+		futures = []
+		with self.lock:
+			for p, depth in depths.items():
+				if p.in_aur:
+					futures.append(self.enqueue(p.srcpkg, depth))
+			self.start_workers()
+
+		return futures
+
+	def fetch(self, srcpkg, depth=0):
+		with self.lock:
+			future = self.enqueue(srcpkg, depth)
+			self.start_workers()
+		return future
+
+	def enqueue(self, srcpkg, depth):
+		if srcpkg not in self.futures:
+			self.futures[srcpkg] = concurrent.futures.Future()
+			heapq.heappush(self.queue, (-depth, next(self.seq), srcpkg))
+		return self.futures[srcpkg]
+
+	def start_workers(self):
+		while self.workers < min(self.jobs, len(self.queue)):
+			self.workers += 1
+			threading.Thread(target=self.work, daemon=True).start()
+
+	def work(self):
+		while True:
+			with self.lock:
+				if not self.queue:
+					self.workers -= 1
+					return
+				_, _, srcpkg = heapq.heappop(self.queue)
+				self.inflight += 1
+				msg = "Fetching {} (queued: {}, in flight: {})"
+				utils.logmsg(self.ctx.v, 2, msg.format(srcpkg.name, len(self.queue), self.inflight))
+
+			future = self.futures[srcpkg]
+			try:
+				srcpkg.get()
+			except Exception as e:
+				utils.logerr(None, "Fetching {} failed: {}".format(srcpkg.name, e))
+				future.set_exception(e)
+			else:
+				future.set_result(srcpkg)
+			finally:
+				with self.lock:
+					self.inflight -= 1
+
+
+def build_packages(packages, ctx, buildflags=[], jobs=1):
+	"""
+	Builds a batch of packages that do not depend on each other (a layer of the
+	DependencyGraph, whose deps have been built and installed before), running up
+	to `jobs` builds at a time. A failed build does not affect the others.
+
+	Returns the given packages that were built successfully.
+	"""
+	succeeded = set()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as e:
+		builds = {e.submit(p.build, buildflags=buildflags): p for p in packages}
+		for build in concurrent.futures.as_completed(builds):
+			p = builds[build]
+			try:
+				success = build.result()
+			except Exception as err:
+				utils.logerr(None, "Building {} failed: {}".format(p.name, err))
+				success = False
+
+			if success:
+				succeeded.add(p)
+
+	return [p for p in packages if p in succeeded]
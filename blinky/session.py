@@ -0,0 +1,76 @@
+import threading, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from blinky import utils
+
+_session      = None
+_session_lock = threading.Lock()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+	"""
+	HTTPAdapter keeping track of how many requests were sent and
+	how many of them were able to reuse an already open connection.
+	"""
+
+	def __init__(self, *args, **kwargs):
+		self.stats_lock = threading.Lock()
+		self.requests   = 0
+		super().__init__(*args, **kwargs)
+
+	def send(self, request, **kwargs):
+		if kwargs.get("timeout") is None:
+			kwargs["timeout"] = utils.session_settings["timeout"]
+		r = super().send(request, **kwargs)
+
+		with self.stats_lock:
+			self.requests += 1
+
+		return r
+
+	@property
+	def connections(self):
+		pools = self.poolmanager.pools
+		return sum(pools[key].num_connections for key in pools.keys())
+
+
+def get_session():
+	"""
+	Returns the HTTP-session shared by all AUR-traffic, so that connections
+	to the AUR are kept alive and reused across threads.
+	"""
+	global _session
+	with _session_lock:
+		if _session is None:
+			retry = Retry(
+					total=utils.session_settings["retries"],
+					backoff_factor=utils.session_settings["backoff"],
+					status_forcelist=[502, 504],
+					allowed_methods=["GET"],
+					raise_on_status=False
+					)
+			adapter = CountingHTTPAdapter(
+					pool_connections=utils.session_settings["pool_size"],
+					pool_maxsize=utils.session_settings["pool_size"],
+					pool_block=True,
+					max_retries=retry
+					)
+			_session = requests.Session()
+			_session.mount("https://", adapter)
+			_session.mount("http://", adapter)
+
+		return _session
+
+
+def get_session_stats():
+	"""returns (number of requests, number of opened connections) of the shared session"""
+	if _session is None:
+		return 0, 0
+
+	requests_sent, connections = 0, 0
+	for adapter in set(_session.adapters.values()):
+		if isinstance(adapter, CountingHTTPAdapter):
+			requests_sent += adapter.requests
+			connections   += adapter.connections
+
+	return requests_sent, connections
@@ -0,0 +1,239 @@
+import os, shutil, hashlib, threading
+from blinky import profiling
+
+# strongest first, the first checksum that is not SKIP identifies a source file;
+# makepkg's ck (CRC) is left out, it cannot tell files apart reliably
+CHECKSUM_ALGOS = {
+	'b2':     hashlib.blake2b,
+	'sha512': hashlib.sha512,
+	'sha384': hashlib.sha384,
+	'sha256': hashlib.sha256,
+	'sha224': hashlib.sha224,
+	'sha1':   hashlib.sha1,
+	'md5':    hashlib.md5,
+}
+VCS_PROTOCOLS  = ['bzr', 'fossil', 'git', 'hg', 'svn']
+
+stats      = {"hits": 0, "misses": 0, "bytes_reused": 0, "rejected": 0}
+stats_lock = threading.Lock()
+
+
+def source_filename(source):
+	"""
+	Returns the filename makepkg stores a source under in SRCDEST and its
+	protocol, (None, None) for files shipped with the PKGBUILD.
+	"""
+	name, sep, url = source.partition('::')
+	if not sep:
+		name, url = None, source
+
+	if '://' not in url:
+		return None, None
+
+	proto = url.split('://', 1)[0].split('+', 1)[0]
+	if name:
+		return name, proto
+
+	name = url.split('#', 1)[0]
+	if proto in VCS_PROTOCOLS:
+		name = name.split('?', 1)[0]
+	name = name.rstrip('/').rsplit('/', 1)[-1]
+
+	if proto == 'git':
+		name = name.split('.git', 1)[0]
+	elif proto == 'fossil':
+		name += '.fossil'
+
+	return name, proto
+
+
+def file_matches(path, key):
+	"""checks that the content of path has the checksum key (<algo>-<hexdigest>) stands for"""
+	algo, _, digest = key.partition('-')
+	h = CHECKSUM_ALGOS[algo]()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1024*1024), b''):
+			h.update(chunk)
+	return h.hexdigest() == digest
+
+
+def parse_srcinfo_sources(path):
+	"""
+	Returns (filename, protocol, key) for every remote source in .SRCINFO, where
+	key identifies its content by checksum and is None for unverified sources.
+	.SRCINFO is not reviewed, so keys are mere claims until a file is checked
+	against them.
+	"""
+	arrays = {}
+	with open(path, 'r', errors='replace') as f:
+		for line in f:
+			key, sep, value = line.strip().partition(' = ')
+			if not sep:
+				continue
+			if key == 'pkgname':
+				break  # sources are only defined for the package base
+			arrays.setdefault(key, []).append(value)
+
+	sources = []
+	for key in [k for k in arrays if k == 'source' or k.startswith('source_')]:
+		suffix = key[len('source'):]
+		for i, source in enumerate(arrays[key]):
+			filename, proto = source_filename(source)
+			if not filename or '/' in filename or filename in ['.', '..']:
+				continue
+
+			checksum = None
+			for algo in CHECKSUM_ALGOS:
+				sums = arrays.get(algo + 'sums' + suffix, [])
+				if i < len(sums) and sums[i] != 'SKIP':
+					digest = sums[i].lower()
+					if digest and all(c in '0123456789abcdef' for c in digest):
+						checksum = "{}-{}".format(algo, digest)
+					break
+
+			sources.append((filename, proto, checksum))
+
+	return sources
+
+
+def tree_size(path):
+	if not os.path.isdir(path) or os.path.islink(path):
+		return os.lstat(path).st_size
+
+	size = 0
+	for dirpath, dirnames, filenames in os.walk(path):
+		for fname in filenames:
+			try:
+				size += os.lstat(os.path.join(dirpath, fname)).st_size
+			except OSError:
+				pass
+	return size
+
+
+class SourceCache:
+	"""
+	Persistent cache of upstream sources shared by all builds. Verified source
+	files are stored by checksum (files/<algo>-<checksum>/<filename>), so files
+	of the same name from different packages never collide and a file is only
+	reused if it is exactly the one the PKGBUILD asks for. VCS checkouts cannot
+	be verified and are kept per package base (vcs/<pkgbase>/<name>).
+
+	Every build gets its own SRCDEST, which is filled with hardlinks (and symlinks
+	for VCS checkouts) to the cache before and harvested for new downloads after
+	makepkg ran.
+	"""
+
+	def __init__(self, cachedir):
+		self.cachedir = cachedir
+		self.filesdir = os.path.join(cachedir, 'files')
+		self.vcsdir   = os.path.join(cachedir, 'vcs')
+
+	def cached_path(self, pkgbase, filename, proto, checksum):
+		if proto in VCS_PROTOCOLS:
+			return os.path.join(self.vcsdir, pkgbase, filename)
+		elif checksum:
+			return os.path.join(self.filesdir, checksum, filename)
+		return None
+
+	def populate(self, pkgbase, srcdir, srcdest):
+		os.makedirs(srcdest, exist_ok=True)
+		srcinfo = os.path.join(srcdir, '.SRCINFO')
+		if not os.path.exists(srcinfo):
+			return
+
+		for filename, proto, checksum in parse_srcinfo_sources(srcinfo):
+			cached = self.cached_path(pkgbase, filename, proto, checksum)
+			dest = os.path.join(srcdest, filename)
+			if not cached or os.path.lexists(dest):
+				continue
+
+			if not os.path.exists(cached):
+				with stats_lock:
+					stats["misses"] += 1
+				profiling.count("source_cache_misses")
+				continue
+
+			if os.path.isdir(cached):
+				os.symlink(cached, dest)
+			else:
+				try:
+					os.link(cached, dest)
+				except OSError:
+					shutil.copy2(cached, dest)  # e.g. build directory on another filesystem
+
+			os.utime(cached)  # marks it as recently used for the eviction
+			profiling.count("source_cache_hits")
+			with stats_lock:
+				stats["hits"] += 1
+				stats["bytes_reused"] += os.path.getsize(cached) if os.path.isfile(cached) else 0
+
+	def collect(self, pkgbase, srcdir, srcdest):
+		"""
+		Takes over what makepkg downloaded into srcdest. Files are only taken
+		over if they actually have the checksum they are to be stored under.
+		"""
+		srcinfo = os.path.join(srcdir, '.SRCINFO')
+		if not os.path.exists(srcinfo):
+			return
+
+		for filename, proto, checksum in parse_srcinfo_sources(srcinfo):
+			cached = self.cached_path(pkgbase, filename, proto, checksum)
+			src = os.path.join(srcdest, filename)
+			if not cached or os.path.islink(src) or not os.path.exists(src):
+				continue
+
+			if proto in VCS_PROTOCOLS:
+				if not os.path.isdir(src):
+					continue
+				os.makedirs(os.path.dirname(cached), exist_ok=True)
+				if os.path.exists(cached):
+					shutil.rmtree(cached)
+				shutil.move(src, cached)
+				os.symlink(cached, src)
+			elif not os.path.isfile(src) or os.path.exists(cached):
+				continue
+			elif not file_matches(src, checksum):
+				profiling.count("source_cache_rejected")
+				with stats_lock:
+					stats["rejected"] += 1
+			else:
+				os.makedirs(os.path.dirname(cached), exist_ok=True)
+				try:
+					os.link(src, cached)
+				except FileExistsError:
+					pass
+				except OSError:
+					shutil.copy2(src, cached)
+
+	def entries(self):
+		"""returns (last use, size, path) of every cached source"""
+		entries = []
+		for parent in [self.filesdir, self.vcsdir]:
+			if not os.path.isdir(parent):
+				continue
+			for keydir in os.scandir(parent):
+				for entry in os.scandir(keydir.path):
+					entries.append((entry.stat(follow_symlinks=False).st_mtime, tree_size(entry.path), entry.path))
+
+		return entries
+
+	def evict(self, max_size):
+		"""removes the least recently used sources until the cache fits into max_size, returns the bytes freed"""
+		entries = sorted(self.entries())
+		total = sum(size for _, size, _ in entries)
+		freed = 0
+		for _, size, path in entries:
+			if total - freed <= max_size:
+				break
+
+			if os.path.isdir(path) and not os.path.islink(path):
+				shutil.rmtree(path, ignore_errors=True)
+			else:
+				os.remove(path)
+			freed += size
+
+			parent = os.path.dirname(path)
+			if not os.listdir(parent):
+				os.rmdir(parent)
+
+		return freed
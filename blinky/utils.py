@@ -1,8 +1,32 @@
 #!/usr/bin/env python3
 
-import requests, sys, os, stat, subprocess
-import termcolor
-from blinky import pacman
+import sys, os, stat, subprocess, threading, functools
+from urllib.parse import quote_plus
+from blinky import pacman, profiling
+
+AUR_URL = "https://aur.archlinux.org"
+
+# the AUR rejects request-URIs longer than 4443 bytes, so info-queries for
+# many packages are split into chunks whose query string stays below this
+AUR_MAX_QUERY_LENGTH = 4000
+
+# settings of the shared HTTP-session (see session.py), can be changed
+# via configure_session() before the first request is made
+session_settings = {
+	"pool_size": 10,
+	"timeout":   (10, 60),  # (connect, read) in seconds
+	"retries":   3,
+	"backoff":   0.5,
+}
+
+# settings of the on-disk cache for AUR-metadata, can be changed via configure_aur_cache()
+aur_cache_settings = {
+	"ttl":     900,    # seconds until a cached record is considered outdated
+	"refresh": False,  # if True, always query the AUR and only update the cache
+}
+
+_aur_cache      = None
+_aur_cache_lock = threading.Lock()
 
 def AmbiguousPacketName(Exception):
 	pass
@@ -13,6 +37,9 @@ def UnknownAURQueryType(Exception):
 class UnsatisfiableDependencyError(Exception):
 	pass
 
+class UnsafeTarballError(Exception):
+	pass
+
 class APIError(Exception):
 	def __init__(self, msg, type):
 		self.message = msg
@@ -20,6 +47,7 @@ class APIError(Exception):
 
 
 def logerr(code, msg, primary=True):
+	import termcolor
 	prefix = ' !>'
 	if not primary:
 		prefix = '   '
@@ -35,6 +63,7 @@ def logmsg(verbosity_level, required_level, msg, primary=True):
 		prefix = '   '
 	if verbosity_level >= required_level:
 		if required_level == 0:
+			import termcolor
 			print(termcolor.colored("{} {}".format(prefix, msg), attrs=["bold"]))
 		else:
 			print("{} {}".format(prefix, msg))
@@ -58,26 +87,197 @@ def delete_onerror(func, path, excinfo):
 		os.remove(path)
 
 
-def query_aur(query_type, arg, single=False, search_by=None, ignore_ood=False):
-	if query_type not in ["info", "search"]:
-		raise UnknownAURQueryType("query {} is not a valid query type".format(query_type))
+class CountingReader:
+	"""file-like wrapper counting the bytes read from the wrapped stream"""
 
-	valid_search_by = search_by in ["name", "name-desc", "maintainer", "depends", "makedepends", "optdepends", "checkdepends"]
+	def __init__(self, stream):
+		self.stream = stream
+		self.bytes  = 0
+
+	def read(self, size=-1):
+		data = self.stream.read(size)
+		self.bytes += len(data)
+		return data
+
+
+def check_tar_member(member, destdir, topdir):
+	"""
+	Raises UnsafeTarballError for tarball members that are not within topdir,
+	would end up outside of destdir/topdir or are neither files, directories
+	nor links. Links must point inside destdir/topdir as well.
+	"""
+	rootdir = os.path.realpath(os.path.join(destdir, topdir))
+
+	def is_within_rootdir(path):
+		path = os.path.realpath(os.path.join(destdir, path))
+		return os.path.commonpath([path, rootdir]) == rootdir
+
+	name = os.path.normpath(member.name)
+	if os.path.isabs(member.name) or not (name == topdir or name.startswith(topdir + '/')) or not is_within_rootdir(name):
+		raise UnsafeTarballError("path {} points outside of {}".format(member.name, topdir))
+
+	if member.issym() or member.islnk():
+		linktarget = member.linkname
+		if member.issym():
+			linktarget = os.path.join(os.path.dirname(name), member.linkname)
+		if name == topdir or os.path.isabs(member.linkname) or not is_within_rootdir(linktarget):
+			raise UnsafeTarballError("link {} points outside of {}".format(member.name, topdir))
+	elif not (member.isfile() or member.isdir()):
+		raise UnsafeTarballError("{} is neither file, directory nor link".format(member.name))
+
+
+def extract_tarball(stream, destdir, topdir, compression='gz'):
+	"""
+	Extracts a tarball whose members all are in topdir into destdir while
+	reading it from the given stream, so it never has to be held in memory or
+	saved to disk as a whole. Members are checked to not escape destdir/topdir
+	before anything is extracted. Links are only created after all files, so no
+	file can be written through a link, and are checked again right before.
+	"""
+	import tarfile
+	extraction_args = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+	with tarfile.open(fileobj=stream, mode='r|' + compression) as tarball:
+		links = []
+		for member in tarball:
+			check_tar_member(member, destdir, topdir)
+			if member.issym() or member.islnk():
+				links.append(member)
+			else:
+				tarball.extract(member, path=destdir, **extraction_args)
+
+		for member in links:
+			check_tar_member(member, destdir, topdir)
+			tarball.extract(member, path=destdir, **extraction_args)
+
+
+def configure_session(pool_size=None, timeout=None, retries=None, backoff=None):
+	"""
+	Adjusts the settings of the shared HTTP-session. Only has an effect
+	if called before the session is first used.
+	"""
+	for key, value in [("pool_size", pool_size), ("timeout", timeout), ("retries", retries), ("backoff", backoff)]:
+		if value is not None:
+			session_settings[key] = value
+
+
+def configure_aur_cache(ttl=None, refresh=None):
+	if ttl is not None:
+		aur_cache_settings["ttl"] = ttl
+	if refresh is not None:
+		aur_cache_settings["refresh"] = refresh
+
+
+def get_aur_cache():
+	global _aur_cache
+	with _aur_cache_lock:
+		if _aur_cache is None:
+			from blinky.aurcache import AURInfoCache
+			cachedir = os.path.join(get_cache_dir(), 'aur-info')
+			_aur_cache = AURInfoCache(cachedir, aur_cache_settings["ttl"])
+
+		return _aur_cache
+
+
+def chunk_info_args(pkgnames, max_length=AUR_MAX_QUERY_LENGTH):
+	"""splits the package names of an info-query into URL-safe chunks"""
+	chunks, chunk, length = [], [], 0
+	for name in pkgnames:
+		arg_length = len("&arg%5B%5D=") + len(quote_plus(name))
+		if chunk and length + arg_length > max_length:
+			chunks.append(chunk)
+			chunk, length = [], 0
+		chunk.append(name)
+		length += arg_length
+
+	if chunk:
+		chunks.append(chunk)
 
-	arg = [arg] if type(arg) != list else arg
+	return chunks
 
+
+def query_aur_remote(query_type, arg, search_by=None):
+	if query_type == "info":
+		chunks = chunk_info_args(arg)
+		if len(chunks) != 1:
+			# fetch all chunks concurrently and merge them into one response
+			aurdata = {"version": 5, "type": "multiinfo", "resultcount": 0, "results": []}
+			if chunks:
+				import concurrent.futures
+				with concurrent.futures.ThreadPoolExecutor(max_workers=session_settings["pool_size"]) as e:
+					for chunkdata in e.map(lambda chunk: query_aur_remote_single(query_type, chunk), chunks):
+						aurdata["resultcount"] += chunkdata["resultcount"]
+						aurdata["results"] += chunkdata["results"]
+
+			return aurdata
+
+	return query_aur_remote_single(query_type, arg, search_by=search_by)
+
+
+def query_aur_remote_single(query_type, arg, search_by=None):
 	arg_type = "arg[]" if query_type == "info" else "arg"
 	query_params = {"type": query_type, "v":5, arg_type:arg}
-	if query_type == "search" and valid_search_by:
+	if query_type == "search" and search_by:
 		query_params["by"] = search_by
 
-	r = requests.get("https://aur.archlinux.org/rpc/", params=query_params)
+	from blinky import session
+	with profiling.span("AUR RPC " + query_type, "rpc", args=len(arg) if query_type == "info" else 1) as span:
+		r = session.get_session().get(AUR_URL + "/rpc/", params=query_params)
+		span["bytes"] = len(r.content)
+	profiling.count("aur_rpc_requests")
+
 	if r.status_code == 429:
 		raise APIError("Rate limit of AUR-API hit", "ratelimit")
 	elif r.status_code == 503:
 		raise APIError("AUR-API currently not available", "unavailable")
 
-	aurdata = r.json()
+	return r.json()
+
+
+def query_aur_info_cached(pkgnames):
+	"""
+	Answers an info-query from the on-disk cache as far as possible and
+	only queries the AUR for packages without valid cache entry.
+	"""
+	cache = get_aur_cache()
+
+	results, missing = [], []
+	for name in dict.fromkeys(pkgnames):
+		hit, record = (False, None) if aur_cache_settings["refresh"] else cache.get(name)
+		if not hit:
+			missing.append(name)
+		elif record:
+			results.append(record)
+
+	profiling.count("aur_cache_hits", len(results))
+	profiling.count("aur_cache_misses", len(missing))
+
+	if missing:
+		aurdata = query_aur_remote("info", missing)
+		found = set()
+		for record in aurdata["results"]:
+			found.add(record["Name"])
+			cache.put(record["Name"], record)
+			results.append(record)
+
+		for name in missing:
+			if name not in found:
+				cache.put(name, None)
+
+	return {"version": 5, "type": "multiinfo", "resultcount": len(results), "results": results}
+
+
+def query_aur(query_type, arg, single=False, search_by=None, ignore_ood=False):
+	if query_type not in ["info", "search"]:
+		raise UnknownAURQueryType("query {} is not a valid query type".format(query_type))
+
+	valid_search_by = search_by in ["name", "name-desc", "maintainer", "depends", "makedepends", "optdepends", "checkdepends"]
+
+	arg = [arg] if type(arg) == str else list(arg)
+
+	if query_type == "info":
+		aurdata = query_aur_info_cached(arg)
+	else:
+		aurdata = query_aur_remote(query_type, arg, search_by=search_by if valid_search_by else None)
 	if ignore_ood:
 		# kick out all packages flagged out-of-date
 		filtered_results = []
@@ -146,6 +346,15 @@ def getchar(msg):
 	return ch
 
 
+def parse_size(size):
+	"""parses sizes like '512M' or '10G' (powers of 1024) into bytes"""
+	units = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+	size = size.strip().upper().rstrip('B').rstrip('I')
+	unit = size[-1:] if size[-1:] in units else ''
+	return int(float(size[:len(size) - len(unit)]) * units[unit])
+
+
+@functools.lru_cache(maxsize=None)
 def get_data_dir():
 	from xdg import BaseDirectory
 
@@ -156,6 +365,7 @@ def get_data_dir():
 	return BaseDirectory.save_data_path('blinky')
 
 
+@functools.lru_cache(maxsize=None)
 def get_cache_dir():
 	from xdg import BaseDirectory
 